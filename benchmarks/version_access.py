@@ -0,0 +1,57 @@
+"""
+Micro-benchmark of version access cost: BaseVersion.version (arguments
+rebuilding on each access) vs precompiled VersionPlan binding.
+Run as (from repository root):
+    PYTHONPATH=. python benchmarks/version_access.py [number]
+"""
+import sys
+import timeit
+import django
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure()
+    django.setup()
+
+from django.core.files.storage import FileSystemStorage
+from diverse.processor import BaseProcessor
+from diverse.version import Version
+from diverse.container import BaseContainer
+
+
+class Processor(BaseProcessor):
+    def extension(self, filever):
+        return '.jpg'
+
+
+class Container(BaseContainer):
+    thumb = Version([Processor(), Processor(), Processor(),])
+    named = Version(Processor(), filename='%(dirname)s/%(basename)s.x%%s')
+
+
+class Source(object):
+    name = 'uploads/2020/01/source.png'
+    storage = FileSystemStorage(location='/tmp')
+
+
+def run(number=100000):
+    source = Source()
+    container = Container(source)
+    results = []
+    for name in ('thumb', 'named',):
+        version = Container._versions[name]
+        plain = timeit.timeit(lambda: version.version(source).name,
+                              number=number)
+        compiled = timeit.timeit(lambda: container.version(name).name,
+                                 number=number)
+        assert version.version(source).name == container.version(name).name
+        results.append((name, plain, compiled,))
+
+    for name, plain, compiled in results:
+        print('%-6s version: %6.2f us, plan: %6.2f us, x%.2f faster' % (
+            name, plain / number * 1e6, compiled / number * 1e6,
+            plain / compiled,))
+
+
+if __name__ == '__main__':
+    run(*[int(i) for i in sys.argv[1:2]])
@@ -1,15 +1,54 @@
+import time
+from diverse import settings
 from diverse.cache import ModelCache
 
 
+# generation priorities (see BaseContainer.create_versions):
+#   critical   - generated inline (right after source file saving)
+#   background - generated in worker pool after transaction commit
+#   ondemand   - generated only on access (lazy versions)
+PRIORITIES = ('critical', 'background', 'ondemand',)
+
+
 class LazyPolicyAccessorMixin(object):
     ac_cache = ModelCache
+    # laziness is derived from priority (lazy versions are ondemand ones)
     ac_lazy  = False
+    ac_priority = settings.DEFAULT_PRIORITY
+    # add content hash to url (?v=hash), so url changes with content
+    ac_versioned_url = settings.VERSIONED_URLS
+
+    # generation metadata keys, stored in cache with data related attrs
+    attrs_meta = ['fingerprint', 'encoding', 'hash', 'features',]
+    # failure record key (quiet mode), stored instead of attrs
+    attrs_failure = 'failure'
 
     def __init__(self, *args, **kwargs):
         super(LazyPolicyAccessorMixin, self).__init__(*args, **kwargs)
         if self.accessor and isinstance(self.accessor, dict):
             self.ac_cache = self.accessor.get('cache', self.ac_cache)
-            self.ac_lazy  = self.accessor.get('lazy', self.ac_lazy)
+            self.ac_versioned_url = self.accessor.get('versioned_url',
+                                                      self.ac_versioned_url)
+            self.ac_priority = self.accessor_priority(self.accessor)
+        if self.ac_priority not in PRIORITIES:
+            raise ValueError('Priority value should be one of %s.'
+                             % ', '.join(PRIORITIES))
+        self.ac_lazy = self.ac_priority == 'ondemand'
+
+    def accessor_priority(self, accessor):
+        """get priority by accessor "priority" or "lazy" (its alias) values"""
+        lazy = accessor.get('lazy', None)
+        priority = accessor.get('priority', None)
+        if priority is None:
+            if lazy is None:
+                return self.ac_priority
+            return ('ondemand' if lazy else
+                    'critical' if self.ac_priority == 'ondemand' else
+                    self.ac_priority)
+        if lazy is not None and bool(lazy) != (priority == 'ondemand'):
+            raise ValueError('Lazy value is inconsistent with priority value'
+                             ' (only ondemand versions are lazy).')
+        return priority
 
     # cache accessors
     def cache_get(self):
@@ -17,20 +56,131 @@ class LazyPolicyAccessorMixin(object):
             return {}
         if not hasattr(self, '_attrs_cache'):
             data = self.ac_cache().get(self) or {}
-            data = dict([(i,j) for i,j in data.items() if i in self.attrs_rel])
+            data = dict([(i,j) for i,j in data.items()
+                         if i in self.attrs_rel or i in self.attrs_meta or
+                         i == self.attrs_failure])
             self._attrs_cache = data
         return self._attrs_cache
 
+    def cache_values(self):
+        """get real values of data related attrs (file should exist)"""
+        return dict((i, self.__getattribute__('_get_%s' % i)(),)
+                    for i in self.attrs_rel)
+
+    def cache_meta(self):
+        """get generation metadata values (of current spec)"""
+        data = dict((i, j,) for i, j in self.generation_meta.items()
+                    if i in self.attrs_meta)
+        data['fingerprint'] = self.fingerprint()
+        return data
+
     def cache_set(self):
         if not self.ac_cache:
             return None
-        data = dict((i, self.__getattribute__('_get_%s' % i)(),)
-                    for i in self.attrs_rel)
+        data = self.cache_values()
+        data.update(self.cache_meta())
         self._attrs_cache = data
         return self.ac_cache().set(self, data)
 
-    def cache_delete(self):
-        self.ac_cache and self.ac_cache().delete(self)
+    def cache_delete(self, batch=None):
+        if not self.ac_cache:
+            return
+        self.__dict__.pop('_attrs_cache', None)
+        batch.add_cache(self) if batch else self.ac_cache().delete(self)
+
+    def is_cached(self):
+        """check that generated file is known by cache (not failure only)"""
+        data = self.cache_get()
+        return any(i in data for i in self.attrs_rel + self.attrs_meta)
+
+    # content hash (computed while generated file is saved)
+    def content_hash(self):
+        return (self.cache_get().get('hash', None) or
+                self.generation_meta.get('hash', None))
+
+    @property
+    def etag(self):
+        content_hash = self.content_hash()
+        return content_hash and '"%s"' % content_hash
+
+    def _get_url(self):
+        url = super(LazyPolicyAccessorMixin, self)._get_url()
+        content_hash = self.ac_versioned_url and self.content_hash()
+        if content_hash:
+            url = '%s%sv=%s' % (url, '&' if '?' in url else '?',
+                                content_hash,)
+        return url
+
+    def is_stale(self, missing=False):
+        """
+        check cached fingerprint of generated file with current spec,
+        missing - result value if fingerprint is not cached (unknown)
+        """
+
+        fingerprint = self.cache_get().get('fingerprint', None)
+        return (missing if fingerprint is None else
+                fingerprint != self.fingerprint())
+
+    # negative cache of failed generations (quiet mode only)
+    def failure(self):
+        """get failure record (reason, time, fingerprint, attempts) or None"""
+        return self.cache_get().get(self.attrs_failure, None)
+
+    def failure_delay(self, attempts):
+        return min(settings.FAILURE_BACKOFF * 2 ** max(attempts - 1, 0),
+                   settings.FAILURE_BACKOFF_MAX)
+
+    def is_failed(self):
+        """
+        check that last generation of current spec is failed and backoff
+        delay is not expired yet (generation should not be retried)
+        """
+
+        failure = self.failure()
+        return bool(failure and settings.FAILURE_BACKOFF and
+                    failure.get('fingerprint') == self.fingerprint() and
+                    time.time() < failure.get('time', 0) +
+                    self.failure_delay(failure.get('attempts', 1)))
+
+    def generation_failed(self, error):
+        super(LazyPolicyAccessorMixin, self).generation_failed(error)
+        if not self.ac_cache or not settings.FAILURE_BACKOFF:
+            return
+        failure = self.failure()
+        attempts = (failure.get('attempts', 0)
+                    if failure and failure.get('fingerprint') ==
+                    self.fingerprint() else 0)
+        data = {self.attrs_failure: {
+            'reason': ('%s: %s' % (error.__class__.__name__, error))[:500],
+            'time': time.time(),
+            'fingerprint': self.fingerprint(),
+            'attempts': attempts + 1,
+        }}
+        self._attrs_cache = data
+        self.ac_cache().set(self, data)
+
+    def failure_clear(self):
+        """delete failure record, it is written to db at once"""
+        if self.ac_cache and self.failure():
+            self.__dict__.pop('_attrs_cache', None)
+            self.ac_cache().delete_many([self], commit=True)
+
+    def generate(self, force=False):
+        # failed recently: skip generation until backoff delay expiration
+        # (forced generation is retried anyway)
+        if not force and not self._generated and self.is_failed():
+            return 1
+        failed = super(LazyPolicyAccessorMixin, self).generate(force=force)
+        if failed or not self.ac_cache:
+            return failed
+        if self.ac_lazy and self.generation_meta:
+            # lazy versions are not cached on creation: keep metadata of
+            # generated file (content hash of url and etag is stable)
+            self._attrs_cache = self.cache_meta()
+            self.ac_cache().set(self, self._attrs_cache)
+        else:
+            self.failure_clear()
+        return failed
 
     # main accessors policy methods: getting, creation and deletion
     # be carefull with modifying this - it is real __getattr__
@@ -74,6 +224,8 @@ class LazyPolicyAccessorMixin(object):
             return None
         self.generate(force=force) or self.ac_lazy or self.cache_set()
 
-    def delete(self):
-        self.ac_lazy or self.cache_delete()
-        self.storage().delete(self.name)
+    def delete(self, batch=None):
+        # lazy versions cache generation metadata (and failure) too
+        self.failure_clear()
+        self.cache_delete(batch=batch)
+        super(LazyPolicyAccessorMixin, self).delete(batch=batch)
@@ -0,0 +1,26 @@
+import asyncio
+import functools
+from django.db import close_old_connections
+from . import settings
+from .workers import get_executor
+
+
+def call(func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        # executor threads do not have request cycle connections cleanup
+        close_old_connections()
+
+
+def run_sync(func, *args, **kwargs):
+    """
+    run blocking function (storage i/o, processors, db queries) in bounded
+    executor (DIVERSE_ASYNC_WORKERS threads), return awaitable result
+    """
+
+    # get_running_loop is available since python 3.7
+    loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)()
+    executor = get_executor('async', workers=settings.ASYNC_WORKERS)
+    return loop.run_in_executor(executor,
+                                functools.partial(call, func, args, kwargs))
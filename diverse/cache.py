@@ -1,5 +1,11 @@
 import json
-from django.db.models import FieldDoesNotExist
+import zlib
+import threading
+from django.db import connections, transaction
+from django.db.models import F, Func, Value, TextField
+from django.db.models.functions import Cast
+from django.core.exceptions import FieldDoesNotExist
+from . import settings, writebehind
 
 
 class BaseCache(object):
@@ -12,77 +18,278 @@ class BaseCache(object):
     def delete(self, version):
         raise NotImplementedError
 
+    def set_many(self, items, commit=None):
+        for version, data in items:
+            self.set(version, data)
+
+    # source file metadata (by container data), optional
+    def get_source(self, data):
+        return {}
+
+    def set_source(self, data, meta, commit=None):
+        return None
+
+    def delete_many(self, versions, commit=None):
+        for version in versions:
+            self.delete(version)
+
+
+class ModelCache(BaseCache):
+    """
+    Cache in model field named "<field>_cache", value is dict of versions
+    data, field types: text (json string), JSONField (native value, with
+    partial updates on PostgreSQL) or BinaryField (compact binary encoding).
+    """
 
-class ModelCache(object):
     update_value_immediately = True
     delete_value_immediately = False
+    # update only changed keys (jsonb_set) in JSONField on PostgreSQL
+    partial_update = True
+    # buffer db writes (see diverse.writebehind)
+    write_behind = settings.WRITE_BEHIND
+
+    # in-memory value read-modify-write lock (versions of one instance
+    # may be generated concurrently, see asyncio api), db writes are done
+    # outside of it (full value is read from instance at write time)
+    lock = threading.RLock()
+
+    # binary encoding: magic, schema version byte and zlib compressed json
+    binary_magic = b'DC'
+    binary_version = 1
+
+    # source file metadata is stored in "meta" of original ("self") key
+    source_key = 'self'
 
     def get_specdata(self, version):
-        if version.data:
-            instance = version.data.get('instance', None)
-            field = version.data.get('field', None)
+        return self.get_datafields(version.data)
+
+    def get_datafields(self, data):
+        """get (instance, cache field name) by container data or Nones"""
+        if data:
+            instance = data.get('instance', None)
+            field = data.get('field', None)
         else:
             instance, field = None, None
 
         try:
             cache = (instance._meta.get_field('%s_cache' % field.name)
-                     if field else None)
+                     if instance and field else None)
         except FieldDoesNotExist:
             cache = None
 
-        return instance, cache.name if instance and cache else (None,)*2
+        return (instance, cache.name,) if cache else (None,)*2
+
+    def get_fieldtype(self, instance, cachefield):
+        return instance._meta.get_field(cachefield).get_internal_type()
+
+    def update_instance(self, instance, cachefield, changed=None,
+                        deleted=None):
+        """
+        write cache value to db, changed (dict) and deleted (list) are
+        versions keys, which are used for partial update if it is possible
+        (or for buffered write, see diverse.writebehind)
+        """
 
-    def update_instance(self, instance, cachefield):
         # do nothing if object still not in database
         if not instance.pk:
             return
 
+        if self.write_behind and (changed or deleted):
+            writebehind.buffer.add(self, instance, cachefield,
+                                   changed=changed, deleted=deleted)
+            return
+
         # call update of queryset to disable models signals
-        queryset = instance.__class__.objects.filter(id=instance.pk)
-        queryset.update(**{cachefield: getattr(instance, cachefield),})
+        queryset = instance.__class__._default_manager.filter(pk=instance.pk)
+        value = getattr(instance, cachefield)
+        if (changed or deleted) and self.is_partial(queryset, cachefield):
+            value = self.partial_value(queryset.model, cachefield,
+                                       changed, deleted)
+        queryset.update(**{cachefield: value,})
+        # value is written directly: remembered written values are outdated
+        writebehind.buffer.forget(self, instance, cachefield)
+
+    def update_row(self, model, pk, cachefield, changed=None, deleted=None,
+                   filters=None):
+        """
+        apply changed and deleted keys to cache value of row in db (not to
+        value of instance in memory), filters - conditions of row actuality
+        """
+
+        queryset = model._default_manager.filter(pk=pk, **(filters or {}))
+        if self.is_partial(queryset, cachefield):
+            return queryset.update(**{cachefield: self.partial_value(
+                model, cachefield, changed, deleted)})
+
+        with transaction.atomic(using=queryset.db):
+            rows = list(queryset.select_for_update()
+                                .values_list(cachefield, flat=True)[:1])
+            if not rows:
+                return 0
+            value = self.decode(rows[0])
+            value.update(changed or {})
+            for key in deleted or []:
+                value.pop(key, None)
+            return queryset.update(**{cachefield: self.encode(
+                value, self.get_fieldtype(model, cachefield))})
+
+    def is_partial(self, queryset, cachefield):
+        """check that only changed keys may be updated (jsonb_set)"""
+        return (self.partial_update and
+                self.get_fieldtype(queryset.model, cachefield) == 'JSONField'
+                and connections[queryset.db].vendor == 'postgresql')
+
+    def partial_value(self, model, cachefield, changed=None, deleted=None):
+        field = model._meta.get_field(cachefield)
+        value = Func(F(cachefield), Value('{}'), function='COALESCE',
+                     output_field=field)
+        for key, data in (changed or {}).items():
+            value = Func(value, Value('{%s}' % key),
+                         Value(json.dumps(data)), Value(True),
+                         function='jsonb_set', output_field=field)
+        for key in deleted or []:
+            value = Func(value, Cast(Value(key), TextField()),
+                         function='', arg_joiner=' - ',
+                         output_field=field)
+        return value
+
+    # cache field value decoding and encoding
+    def decode(self, cache):
+        if isinstance(cache, dict):
+            return dict(cache)
+        if isinstance(cache, (bytes, memoryview,)):
+            return self.decode_binary(bytes(cache))
+        try:
+            return json.loads(cache) if cache else {}
+        except ValueError:
+            return {}
+
+    def encode(self, value, fieldtype=None):
+        if fieldtype == 'JSONField':
+            return value
+        if fieldtype == 'BinaryField':
+            return self.encode_binary(value) if value else b''
+        return json.dumps(value) if value else ''
+
+    def decode_binary(self, cache):
+        header = self.binary_magic + bytes([self.binary_version])
+        if not cache.startswith(header):
+            return {}
+        try:
+            return json.loads(zlib.decompress(cache[len(header):]))
+        except (zlib.error, ValueError):
+            return {}
+
+    def encode_binary(self, value):
+        value = json.dumps(value, separators=(',', ':',)).encode('utf-8')
+        return (self.binary_magic + bytes([self.binary_version]) +
+                zlib.compress(value))
 
     def get(self, version):
         instance, cachefield = self.get_specdata(version)
 
         value = {}
         if instance and cachefield:
-            cache = getattr(instance, cachefield, '')
-            try:
-                value = json.loads(cache) if cache else {}
-            except ValueError:
-                value = {}
+            value = self.decode(getattr(instance, cachefield, ''))
             value = value.get(version.attrname, {})
 
         return value
 
     def set(self, version, data):
-        instance, cachefield = self.get_specdata(version)
-        if instance and cachefield:
-            cache = getattr(instance, cachefield, '')
+        return self.set_many([(version, data,)])
 
-            try:
-                value = json.loads(cache) if cache else {}
-            except ValueError:
-                value = {}
-            value[version.attrname] = data
-            setattr(instance, cachefield, json.dumps(value))
+    def set_many(self, items, commit=None):
+        """
+        set values of (version, data) items with one write for each instance,
+        commit - write to db, default is update_value_immediately
+        """
 
-            if self.update_value_immediately:
-                self.update_instance(instance, cachefield)
+        commit = self.update_value_immediately if commit is None else commit
+        with self.lock:
+            writes = self._set_many(items)
+        if commit:
+            for instance, cachefield, values in writes:
+                self.update_instance(instance, cachefield, changed=values)
+        return True
+
+    def _set_many(self, items):
+        writes = []
+        for instance, cachefield, values in self.group(items):
+            value = self.decode(getattr(instance, cachefield, ''))
+            value.update(values)
+            setattr(instance, cachefield, self.encode(
+                value, self.get_fieldtype(instance, cachefield)))
+            writes.append((instance, cachefield, values,))
+        return writes
+
+    def get_source(self, data):
+        instance, cachefield = self.get_datafields(data)
+        if not instance or not cachefield:
+            return {}
+        value = self.decode(getattr(instance, cachefield, ''))
+        return value.get(self.source_key, {}).get('meta', {})
+
+    def set_source(self, data, meta, commit=None):
+        """
+        set source file metadata (see diverse.imageinfo.ImageInfo.as_dict),
+        commit - write to db, default is update_value_immediately
+        """
+
+        instance, cachefield = self.get_datafields(data)
+        if not instance or not cachefield:
+            return False
 
+        commit = self.update_value_immediately if commit is None else commit
+        with self.lock:
+            value = self.decode(getattr(instance, cachefield, ''))
+            values = {self.source_key: dict(value.get(self.source_key, {}),
+                                            meta=meta)}
+            value.update(values)
+            setattr(instance, cachefield, self.encode(
+                value, self.get_fieldtype(instance, cachefield)))
+        if commit:
+            self.update_instance(instance, cachefield, changed=values)
         return True
 
     def delete(self, version):
-        instance, cachefield = self.get_specdata(version)
-        if instance and cachefield:
-            cache = getattr(instance, cachefield, '')
+        self.delete_many([version])
+
+    def delete_many(self, versions, commit=None):
+        """
+        delete values of versions with one write for each instance,
+        commit - write to db, default is delete_value_immediately
+        """
+
+        commit = self.delete_value_immediately if commit is None else commit
+        with self.lock:
+            writes = self._delete_many(versions)
+        for instance, cachefield, deleted in writes:
+            if commit:
+                self.update_instance(instance, cachefield, deleted=deleted)
+            else:
+                # deleted in memory only (written with row later)
+                writebehind.buffer.forget(self, instance, cachefield,
+                                          deleted)
 
-            try:
-                value = json.loads(cache) if cache else {}
-            except ValueError:
-                value = {}
-            value.pop(version.attrname, None)
-            setattr(instance, cachefield, json.dumps(value) if value else '')
+    def _delete_many(self, versions):
+        writes = []
+        for instance, cachefield, values in self.group(
+                (i, None,) for i in versions):
+            value = self.decode(getattr(instance, cachefield, ''))
+            for attrname in values:
+                value.pop(attrname, None)
+            setattr(instance, cachefield, self.encode(
+                value, self.get_fieldtype(instance, cachefield)))
+            writes.append((instance, cachefield, list(values),))
+        return writes
 
-            if self.delete_value_immediately:
-                self.update_instance(instance, cachefield)
+    def group(self, items):
+        """group (version, data) items by instance and cache field"""
+        groups = {}
+        for version, data in items:
+            instance, cachefield = self.get_specdata(version)
+            if instance and cachefield:
+                groups.setdefault((id(instance), cachefield,),
+                                  (instance, cachefield, {},)
+                                  )[2][version.attrname] = data
+        return groups.values()
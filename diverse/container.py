@@ -1,5 +1,14 @@
 import os
+import asyncio
+import functools
+from django.db import transaction, close_old_connections
+from . import settings
+from .aio import run_sync
+from .workers import get_executor
+from .cache import ModelCache
+from .imageinfo import get_file_meta
 from .version import BaseVersion
+from .deletion import DeletionBatch
 
 
 class MetaContainer(type):
@@ -11,6 +20,19 @@ class MetaContainer(type):
                 continue
             cclass.version_register(name, value, original=(name == 'self'))
 
+        # link derived versions to its sources and get creation order
+        cclass._versions_order = cclass.versions_order()
+        for name in cclass._versions_order:
+            version = cclass._versions[name]
+            version.source and version.link_source(
+                cclass._versions[version.source])
+
+        # compile plans once per class (after all params are applied)
+        cclass._plans = dict((i, j.compile(),)
+                             for i, j in cclass._versions.items())
+        if cclass._version_original:
+            cclass._plans['self'] = cclass._version_original.compile()
+
         return cclass
 
 
@@ -21,10 +43,14 @@ class BaseContainer(metaclass=MetaContainer):
     """
 
     attrname = 'dc'
+    # cache of source file metadata (None to disable)
+    source_cache = ModelCache
     _versions = None
     _version_original = None
+    _plans = None
+    _versions_order = None
     _version_params = ('conveyor', 'versionfile', 'accessor',
-                       'filename', 'extension', 'storage',)
+                       'filename', 'extension', 'storage', 'layout',)
 
     @classmethod
     def version_params(cls):
@@ -48,10 +74,42 @@ class BaseContainer(metaclass=MetaContainer):
             cls._versions.__setitem__(name, value)
         hasattr(cls, name) and delattr(cls, name)
 
+    @classmethod
+    def versions_order(cls):
+        """
+        get versions names in order of dependencies (sources first),
+        raise ValueError if source is missing or there is a cycle
+        """
+
+        order, visiting = [], []
+
+        def visit(name):
+            if name in order:
+                return
+            if name in visiting:
+                raise ValueError(
+                    'Versions of container "%s" have circular source'
+                    ' dependency: %s.' % (cls.__name__,
+                                          ' -> '.join(visiting + [name])))
+            source = cls._versions[name].source
+            if source and source not in cls._versions:
+                raise ValueError(
+                    'Source version "%s" of version "%s" does not exists in'
+                    ' container "%s".' % (source, name, cls.__name__,))
+            visiting.append(name)
+            source and visit(source)
+            visiting.pop()
+            order.append(name)
+
+        for name in cls._versions.keys():
+            visit(name)
+        return order
+
     def __init__(self, source_file, data=None):
         self.source_file = source_file
         self.data = data
         self._versionfiles = {}
+        self._source_meta = None
 
     def __getattr__(self, name):
         if name in self._versionfiles:
@@ -80,8 +138,15 @@ class BaseContainer(metaclass=MetaContainer):
         if not version:
             raise IndexError('Version with name "%s" does not exists.' % name)
 
+        # derived versions get source version file as parent
+        parent = (self.__getattr__(version.source)
+                  if version.source and name != 'self' else None)
+
+        plan = self._plans.get(name, None)
+        if plan and instantiate:
+            return plan.bind(self.source_file, data=self.data, parent=parent)
         return version.version(self.source_file, data=self.data,
-                               instantiate=instantiate)
+                               instantiate=instantiate, parent=parent)
 
     def change_original(self):
         """change source file before save with "self" version"""
@@ -93,12 +158,207 @@ class BaseContainer(metaclass=MetaContainer):
             versionfile = cls(*args, **kwargs)
             versionfile.create(force=True)
 
-    def create_versions(self):
-        """call "create" for each version (policy)"""
-        for name in self._versions.keys():
-            self.__getattr__(name).create()
+    def source_meta(self):
+        """
+        get source file metadata (format, dimensions, frames (counted up
+        to 2), orientation and colour mode), it is extracted once at file
+        saving and cached, files without cached value are parsed here
+        """
+
+        if self._source_meta is None:
+            cache = self.source_cache and self.source_cache()
+            meta = cache.get_source(self.data) if cache else {}
+            if not meta:
+                meta = self.extract_source_meta()
+                cache and meta and cache.set_source(self.data, meta,
+                                                    commit=False)
+            self._source_meta = meta
+        return self._source_meta
+
+    def extract_source_meta(self, file=None):
+        """extract metadata from file (content) or from source file"""
+        return get_file_meta(self.source_file if file is None else file)
+
+    def set_source_meta(self, meta=None, commit=None):
+        """cache metadata (or extract it from source file)"""
+        meta = self.extract_source_meta() if meta is None else meta
+        self._source_meta = meta
+        if self.source_cache and meta:
+            self.source_cache().set_source(self.data, meta, commit=commit)
+
+    def versions_priorities(self):
+        """get {name: priority} of versions (see accessor PRIORITIES)"""
+        return dict((i, getattr(self.__getattr__(i), 'ac_priority',
+                                'critical'),)
+                    for i in self._versions_order)
+
+    def create_versions(self, background=True, using=None):
+        """
+        call "create" for each version (policy), sources first: critical
+        versions are created here, background ones are created in worker
+        pool after current transaction commit (or here if background is
+        False), ondemand ones are not created (only on access)
+        """
+
+        priorities = self.versions_priorities()
+        names = [i for i in self._versions_order
+                 if priorities[i] == 'background']
+        for name in self._versions_order:
+            if priorities[name] == 'critical' or (
+                    priorities[name] == 'background' and not background):
+                self.__getattr__(name).create()
+
+        if names and background:
+            # worker gets row only (instance is not shared with it)
+            row = self.row()
+            executor = get_executor('background',
+                                    workers=settings.BACKGROUND_WORKERS)
+            task = (functools.partial(create_row_versions, *row, names=names)
+                    if row else
+                    functools.partial(self.create_background, names))
+            transaction.on_commit(lambda: executor.submit(task),
+                                  using=using or (row and row[3]))
+
+    def create_background(self, names):
+        """
+        create versions by names (in worker pool thread), it is used if
+        source file is not held by model instance (see create_row_versions)
+        """
+
+        try:
+            for name in names:
+                self.__getattr__(name).create()
+        finally:
+            close_old_connections()
+
+    async def acreate_versions(self):
+        """
+        async "create" for each version, versions without dependencies
+        between each other are created concurrently (by levels)
+        """
+
+        levels, priorities = {}, self.versions_priorities()
+        for name in self._versions_order:
+            if priorities[name] == 'ondemand':
+                continue
+            # ondemand source is generated by derived version (if any)
+            source = self._versions[name].source
+            levels[name] = levels.get(source, -1) + 1 if source else 0
+        for level in sorted(set(levels.values())):
+            await asyncio.gather(*[self.__getattr__(i).acreate()
+                                   for i, j in levels.items() if j == level])
 
-    def delete_versions(self):
-        """call "delete" for each version (policy)"""
+    async def adelete_versions(self):
+        await run_sync(self.delete_versions)
+
+    def dependent_versions(self, names):
+        """get names with names of all versions derived from them"""
+        names = set(names)
+        for name in self._versions_order:
+            if self._versions[name].source in names:
+                names.add(name)
+        return [i for i in self._versions_order if i in names]
+
+    def stale_versions(self, missing=False):
+        """
+        names of versions, which cached fingerprint differs from current
+        spec one (see VersionFile.is_stale for missing param meaning)
+        """
+
+        return [i for i in self._versions.keys()
+                if self.__getattr__(i).is_stale(missing=missing)]
+
+    def update_versions(self, names=None, missing=False):
+        """
+        regenerate only stale versions (or versions by names),
+        return list of names of regenerated versions
+        """
+
+        names = self.stale_versions(missing) if names is None else names
+        names = self.dependent_versions(names)
+        if names:
+            batch = DeletionBatch()
+            for name in names:
+                self.__getattr__(name).delete(batch=batch)
+            batch.commit(callback=lambda: [self.__getattr__(i).create()
+                                           for i in names])
+        return names
+
+    def delete_versions(self, batch=None, callback=None, using=None):
+        """
+        call "delete" for each version (policy), files are collected into
+        deletion batch and deleted at once (commit is done here if batch is
+        not passed, see DeletionBatch.commit for callback meaning)
+        """
+
+        commit = batch is None
+        batch = DeletionBatch() if commit else batch
         for name in self._versions.keys():
-            self.__getattr__(name).delete()
+            self.__getattr__(name).delete(batch=batch)
+        commit and batch.commit(callback=callback, using=using)
+
+    def row(self):
+        """
+        get (model, pk, field name, database alias) of model instance,
+        which holds source file, or None (data is not model instance)
+        """
+
+        instance = (self.data or {}).get('instance', None)
+        field = (self.data or {}).get('field', None)
+        if instance is None or field is None or instance.pk is None:
+            return None
+        return (instance.__class__, instance.pk, field.name,
+                instance._state.db or 'default',)
+
+
+def create_row_versions(model, pk, field_name, using, names=None):
+    """
+    create versions (by names or by priorities if names is None) of file of
+    row, which is fetched here: it is called in worker threads, so model
+    instance of request thread is not shared with them
+    """
+
+    try:
+        instance = model._default_manager.db_manager(using).filter(
+            pk=pk).first()
+        file = instance and getattr(instance, field_name)
+        if not file:
+            return
+        container = file._container
+        if names is None:
+            container.create_versions(background=False)
+        else:
+            for name in names:
+                container.__getattr__(name).create()
+    finally:
+        close_old_connections()
+
+
+def update_versions_batch(items):
+    """
+    regenerate versions of several containers of one field, items - list
+    of (container, names) pairs (see BaseContainer.update_versions), same
+    version of all containers is generated after one prepare call of its
+    conveyor (see Conveyor.prepare), return list of regenerated names lists
+    """
+
+    items = [(i, i.dependent_versions(j),) for i, j in items]
+    items = [(i, j,) for i, j in items if j]
+    if not items:
+        return []
+
+    def create():
+        for name in items[0][0]._versions_order:
+            filevers = [i.__getattr__(name) for i, j in items if name in j]
+            if not filevers:
+                continue
+            filevers[0].conveyor().prepare(filevers)
+            for filever in filevers:
+                filever.create()
+
+    batch = DeletionBatch()
+    for container, names in items:
+        for name in names:
+            container.__getattr__(name).delete(batch=batch)
+    batch.commit(callback=create)
+    return [j for i, j in items]
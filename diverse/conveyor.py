@@ -3,12 +3,41 @@ import time
 import shutil
 import hashlib
 import mimetypes
+from django.core.files.base import File
 from django.core.files.storage import FileSystemStorage
-from . import settings
+from . import settings, profiling, watchdog
+
+# length of content hash of version file (hex digest prefix)
+HASH_LENGTH = 12
 
 
 class VersionGenerationError(Exception):
-    pass
+    # processors timings [(processor, seconds,),] (time limits errors)
+    timings = None
+
+
+class HashingFile(File):
+    """
+    File wrapper, which computes hash of content while it is read by
+    storage (rewinding to start resets hash, if storage reads file twice)
+    """
+
+    def __init__(self, file, name=None):
+        super(HashingFile, self).__init__(file, name=name)
+        self.hasher = hashlib.md5()
+
+    def read(self, *args, **kwargs):
+        data = self.file.read(*args, **kwargs)
+        self.hasher.update(data)
+        return data
+
+    def seek(self, offset, *args):
+        if offset == 0 and not args:
+            self.hasher = hashlib.md5()
+        return self.file.seek(offset, *args)
+
+    def hexdigest(self):
+        return self.hasher.hexdigest()[:HASH_LENGTH]
 
 
 class Conveyor(object):
@@ -26,53 +55,122 @@ class Conveyor(object):
     def run(self, filever, force=False):
         raise NotImplementedError
 
+    def prepare(self, filevers):
+        """
+        prepare generation of same version of several source files, which
+        are generated by run after it (first processor of version may
+        process them together, see BaseProcessor.prepare_batch)
+        """
+
+        processors = filevers and filevers[0].processors()
+        prepare = processors and getattr(processors[0], 'prepare_batch', None)
+        prepare and prepare(filevers)
+
 
 class TempFileConveyor(Conveyor):
+    # time limits in seconds (None - unlimited) of all processors of version
+    # and of each processor (processor "time_limit" attr overrides it),
+    # processors run in supervised process and are cancelled on overrun
+    time_limit = settings.VERSION_TIME_LIMIT
+    processor_time_limit = settings.PROCESSOR_TIME_LIMIT
+
     def __init__(self, *args, **kwargs):
         self.storage = FileSystemStorage(location=settings.TEMPORARY_DIR)
         super(TempFileConveyor, self).__init__(*args, **kwargs)
 
+    @classmethod
+    def limited(cls, time_limit=None, processor_time_limit=None):
+        """
+        get conveyor class with time limits (per version limits):
+            ImageVersion(..., conveyor=TempFileConveyor.limited(10, 5))
+        """
+
+        return type(cls.__name__, (cls,), {
+            'time_limit': time_limit,
+            'processor_time_limit': processor_time_limit,})
+
+    def limit(self, processor, elapsed):
+        """time limit of processor call (by version limit remainder)"""
+        limits = [getattr(processor, 'time_limit', None) or
+                  self.processor_time_limit,
+                  self.time_limit and self.time_limit - elapsed,]
+        limits = [i for i in limits if i is not None]
+        return max(min(limits), 0.001) if limits else None
+
+    def run_processor(self, processor, tempname, mimetype, filever, limit):
+        if not limit:
+            return processor.run(tempname, mimetype, self.storage, filever)
+        # generation metadata is filled by processor in child process
+        tempname, mimetype, meta = watchdog.call(
+            self._run_processor, (processor, tempname, mimetype, filever,),
+            limit=limit)
+        filever.generation_meta.clear()
+        filever.generation_meta.update(meta)
+        return tempname, mimetype
+
+    def _run_processor(self, processor, tempname, mimetype, filever):
+        tempname, mimetype = processor.run(tempname, mimetype,
+                                           self.storage, filever)
+        return tempname, mimetype, filever.generation_meta
+
     def run(self, filever, force=False):
         source_file = filever.source_file
         dest_storage = filever.storage()
         replace_mode = False
 
         # check self processing (equality of source and destination)
-        if dest_storage.path(filever.path) == dest_storage.path(
-                source_file.path) and filever.attrname == 'self':
+        # (files are operated by names, destination may be not local),
+        # file is always written to current layout location
+        name = filever.filename()
+        if name == source_file.name and filever.attrname == 'self':
             replace_mode = True
 
-        # check file existance and force
-        if not replace_mode and dest_storage.exists(filever.path):
-            if not force:
+        # check file existance and force, file of fallback layout location
+        # is moved instead of processing (or dropped if it is forced)
+        if not replace_mode:
+            if dest_storage.exists(name):
+                if not force:
+                    return
+                dest_storage.delete(name)
+            if filever.restore_fallback(discard=force):
                 return
-            dest_storage.delete(filever.path)
-
-        # open (rb mode) source file
-        source_closed = source_file.closed
-        source_closed and source_file.open()
 
         # get hasher
         md5hash = hashlib.md5()
         md5hash.update('{}@{}'.format(source_file.name,
                                       time.time()).encode('utf-8', 'ignore'))
 
-        # create temporary file and get mimetype
-        tempname = os.path.splitext(source_file.name)
-        tempname = '%s%s' % (md5hash.hexdigest(), tempname[1])
-        tempname = self.storage.save(tempname, source_file)
+        # open (rb mode) source file (or source version file of derived
+        # version), create temporary file and get mimetype
+        with profiling.stage('source'), filever.process_source() as source:
+            tempname = os.path.splitext(source.name)
+            tempname = '%s%s' % (md5hash.hexdigest(), tempname[1])
+            tempname = self.storage.save(tempname, source)
         mimetype = mimetypes.guess_type(tempname)
 
-        # close source
-        source_closed and source_file.close()
-
         # safe processors call and close source
-        status = True
+        status, timings, start = True, [], time.monotonic()
         try:
             # run processors conveyor
-            for processor in filever.processors():
-                tempname, mimetype = processor.run(tempname, mimetype,
-                                                    self.storage, filever)
+            for index, processor in enumerate(filever.processors()):
+                label = '%s.%s' % (index, processor.__class__.__name__,)
+                elapsed = time.monotonic() - start
+                with profiling.stage(label):
+                    try:
+                        tempname, mimetype = self.run_processor(
+                            processor, tempname, mimetype, filever,
+                            self.limit(processor, elapsed))
+                    except watchdog.TimeLimitExceeded as e:
+                        # file of cancelled processor has known temporary
+                        # name, it is deleted below (in finally)
+                        timings.append((label, e.elapsed,))
+                        error = VersionGenerationError(
+                            '%s Timings: %s, total: %.3fs.' % (
+                                e, ', '.join('%s %.3fs' % i for i in timings),
+                                time.monotonic() - start,))
+                        error.timings = timings
+                        raise error
+                timings.append((label, time.monotonic() - start - elapsed,))
                 if not tempname:
                     break
         except Exception as e:
@@ -88,10 +186,14 @@ class TempFileConveyor(Conveyor):
             if status:
                 # save target file with destination storage
                 # todo: check new filename correctness
-                if replace_mode:
-                    dest_storage.delete(filever.path)
-                with self.storage.open(tempname) as tempfile:
-                    dest_storage.save(filever.path, tempfile)
+                with profiling.stage('save'):
+                    if replace_mode:
+                        dest_storage.delete(name)
+                    # content hash is computed while destination writes
+                    with self.storage.open(tempname) as tempfile:
+                        tempfile = HashingFile(tempfile, name=tempname)
+                        dest_storage.save(name, tempfile)
+                        filever.generation_meta['hash'] = tempfile.hexdigest()
         finally:
             # delete temporary
             # warning: delete is unsafe with locks (especially write mode locks)
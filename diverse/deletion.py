@@ -0,0 +1,202 @@
+import os
+import threading
+from contextlib import contextmanager
+from django.db import transaction, close_old_connections
+from django.core.files.storage import FileSystemStorage
+from . import settings
+from .workers import get_executor
+
+_state = threading.local()
+
+
+@contextmanager
+def suppress_erase(model):
+    """disable per row files erasing in diverse fields post_delete handlers"""
+    models = _state.__dict__.setdefault('models', [])
+    models.append(model)
+    try:
+        yield
+    finally:
+        models.pop()
+
+
+def is_erase_suppressed(model):
+    return model in getattr(_state, 'models', ())
+
+
+class DeletionBatch(object):
+    """
+    Collection of files to delete from storages, deletes all collected files
+    at once (in parallel), immediately or after transaction commit.
+    Files of local storages are deleted per directory: many files of one
+    directory are found by one scandir call instead of exists/delete calls
+    for each file, few ones (less than scan_threshold) are unlinked directly
+    (scandir is O(directory size)).
+    Versions caches are cleared at commit by one write per cache holder.
+    """
+
+    # min count of names of one directory to find them by scandir
+    scan_threshold = 64
+
+    def __init__(self):
+        self.storages = {}
+        self.names = {}
+        self.versions = []
+
+    def __len__(self):
+        return sum(len(i) for i in self.names.values())
+
+    def add(self, storage, name):
+        key = id(storage)
+        self.storages.setdefault(key, storage)
+        self.names.setdefault(key, set()).add(name)
+
+    def add_cache(self, version):
+        self.versions.append(version)
+
+    def clear_caches(self):
+        """clear caches of versions, grouped by cache class"""
+        groups = {}
+        for version in self.versions:
+            groups.setdefault(version.ac_cache, []).append(version)
+        self.versions = []
+        for cache, versions in groups.items():
+            cache().delete_many(versions)
+
+    def delete(self, storage, name):
+        storage.delete(name)
+
+    def delete_local(self, directory, names):
+        if len(names) < self.scan_threshold:
+            entries = [os.path.join(directory, i) for i in names]
+        else:
+            try:
+                with os.scandir(directory) as entries:
+                    entries = [i.path for i in entries if i.name in names]
+            except FileNotFoundError:
+                return
+        for path in entries:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def tasks(self):
+        tasks = []
+        for key, names in self.names.items():
+            storage = self.storages[key]
+            if not isinstance(storage, FileSystemStorage):
+                tasks.extend((self.delete, storage, i,) for i in names)
+                continue
+            directories = {}
+            for name in names:
+                directory, name = os.path.split(storage.path(name))
+                directories.setdefault(directory, set()).add(name)
+            tasks.extend((self.delete_local, i, j,)
+                         for i, j in directories.items())
+        self.storages, self.names = {}, {}
+        return tasks
+
+    def run(self, workers=None, callback=None):
+        """
+        delete all collected files, return count of processed files,
+        callback is called after deletion (regeneration of versions usually)
+        """
+
+        count = len(self)
+        executor = get_executor('deletion', workers=workers)
+        futures = [executor.submit(*i) for i in self.tasks()]
+        errors = [i.exception() for i in futures if i.exception()]
+        # callback is called anyway (versions are deleted at least partly)
+        callback and callback()
+        if errors and not settings.QUIET_OPERATION:
+            raise errors[0]
+        return count
+
+    def run_background(self, callback=None):
+        try:
+            self.run(callback=callback)
+        finally:
+            close_old_connections()
+
+    def commit(self, on_commit=None, background=None, using=None,
+               callback=None):
+        """
+        on_commit  - run deletion after current transaction commit
+                     (immediately if there is no active transaction)
+        background - do not wait deletion (run in background thread)
+        callback   - call after deletion (in the same thread)
+        defaults are DIVERSE_DELETE_ON_COMMIT and DIVERSE_DELETE_IN_BACKGROUND
+        """
+
+        on_commit = settings.DELETE_ON_COMMIT if on_commit is None else on_commit
+        background = (settings.DELETE_IN_BACKGROUND
+                      if background is None else background)
+
+        self.clear_caches()
+        if not len(self):
+            callback and callback()
+            return
+        run = ((lambda: get_executor('deletion-background').submit(
+                    self.run_background, callback=callback))
+               if background else (lambda: self.run(callback=callback)))
+        transaction.on_commit(run, using=using) if on_commit else run()
+
+
+def bulk_delete(queryset, fields=None, on_commit=True, background=False,
+                chunk_size=1000):
+    """
+    Delete queryset objects and erase files of diverse fields in bulk:
+    references of files are checked by one grouped query per field (per
+    chunk_size names), originals (if field is erasable) and versions are
+    deleted through DeletionBatch (in parallel, optionally after commit).
+    fields - names of diverse fields to process (all by default)
+    """
+
+    # import here to avoid circular import
+    from .fields.fields import DiverseFileField
+
+    model = queryset.model
+    fields = [i for i in model._meta.concrete_fields
+              if isinstance(i, DiverseFileField) and
+              (fields is None or i.name in fields)]
+
+    # collect file names (and any pk value to build field file)
+    names = dict((i.attname, {},) for i in fields)
+    values = queryset.values_list('pk', *[i.attname for i in fields])
+    for row in values.iterator(chunk_size=chunk_size):
+        for field, name in zip(fields, row[1:]):
+            name and names[field.attname].setdefault(name, row[0])
+
+    with suppress_erase(model):
+        result = queryset.delete()
+
+    batch = DeletionBatch()
+    manager = model._default_manager.using(queryset.db)
+    for field in fields:
+        unique = list(names[field.attname].keys())
+
+        # get still referenced names by one grouped query (per chunk)
+        referenced = set()
+        for index in range(0, len(unique), chunk_size):
+            chunk = unique[index:index+chunk_size]
+            referenced.update(
+                manager.filter(**{'%s__in' % field.attname: chunk})
+                       .order_by().values_list(field.attname, flat=True)
+                       .distinct())
+
+        for name in unique:
+            if name in referenced:
+                continue
+            instance = model(**{'pk': names[field.attname][name],
+                                field.attname: name,})
+            file = getattr(instance, field.attname)
+            if field.erasable and name != field.default:
+                batch.add(file.storage, name)
+            for version in file._container._versions.keys():
+                version = getattr(file._container, version)
+                batch.add(version.storage(), version.name)
+
+    batch.commit(on_commit=on_commit, background=background,
+                 using=queryset.db)
+    return result
@@ -1,35 +1,87 @@
 import os
+import copy
+import functools
 from django.db.models import signals
-from django.db.models.fields.files import FileField, FieldFile
-from django.db.models.fields.files import ImageField, ImageFieldFile
+from django.db.models.fields.files import FileField, FieldFile, FileDescriptor
+from django.db.models.fields.files import (ImageField, ImageFieldFile,
+                                           ImageFileDescriptor)
 from django.utils.safestring import mark_safe
 from django.core import checks
+from django.core.exceptions import FieldDoesNotExist
 from django.contrib.admin.options import FORMFIELD_FOR_DBFIELD_DEFAULTS
 from .forms import DiverseFormFileField, DiverseFormImageField
 from .widgets import DiverseFileInput, DiverseImageFileInput
 from .validators import isuploaded
+from ..views import versions_url
+from ..deletion import is_erase_suppressed
+from ..container import create_row_versions
+from .. import settings
+
+
+# containers cache (in model instance)
+class ContainersCache(dict):
+    """Containers by (field name, file name), it is not pickled."""
+
+    def __reduce__(self):
+        return (self.__class__, ())
+
+    @classmethod
+    def for_instance(cls, instance):
+        cache = instance.__dict__.get('__diverse_containers__', None)
+        if cache is None:
+            cache = instance.__dict__['__diverse_containers__'] = cls()
+        return cache
+
+    @classmethod
+    def invalidate(cls, instance, field):
+        cache = instance.__dict__.get('__diverse_containers__', None)
+        for key in [i for i in cache or () if i[0] == field.name]:
+            cache.pop(key, None)
 
 
 # file attr class
 class DiverseFieldFile(FieldFile):
     def __getattr__(self, name):
         # do not create container attr by default (should i?)
-        container = self.get_container()
+        container = self.get_cached_container()
         if name in (container.attrname, '_container'):
-            data = {'instance': self.instance, 'field': self.field,}
-            self._container = container(self, data)
+            self._container = container
             setattr(self, container.attrname, self._container)
         return self.__getattribute__(name)
 
-    def save(self, *args, **kwargs):
-        super(DiverseFieldFile, self).save(*args, **kwargs)
+    def save(self, name, content, save=True):
+        # instance is saved after metadata setting (it is written with row)
+        super(DiverseFieldFile, self).save(name, content, save=False)
+        # file name is changed: forget container of previous one
+        self.__dict__.pop('_container', None)
+        self.__dict__.pop(self.get_container().attrname, None)
+        # extract metadata from saved content at once (commited with row)
+        container = self._container
+        container.set_source_meta(container.extract_source_meta(content),
+                                  commit=False)
         if not self.field.get_action(self.instance):
             self.field.set_action(self.instance, '__update__') # in post_save
+        if save:
+            self.instance.save()
 
     def delete(self, *args, **kwargs):
         self._container.delete_versions()
         super(DiverseFieldFile, self).delete(*args, **kwargs)
 
+    def get_cached_container(self):
+        """
+        get container instance, cached in model instance for field and
+        file name (so, versions objects are reused by rewrapped files too)
+        """
+
+        cache = ContainersCache.for_instance(self.instance)
+        key = (self.field.name, self.name,)
+        container = cache.get(key, None)
+        if container is None:
+            data = {'instance': self.instance, 'field': self.field,}
+            container = cache[key] = self.get_container()(self, data)
+        return container
+
     def get_container(self):
         method = 'get_container_for_{}'.format(self.field.name)
         if hasattr(self.instance, method):
@@ -44,21 +96,70 @@ class DiverseFieldFile(FieldFile):
 
 # image attr class
 class DiverseImageFieldFile(DiverseFieldFile, ImageFieldFile):
+    def _get_image_dimensions(self):
+        # dimensions from source metadata instead of parsing file by PIL
+        if not hasattr(self, '_dimensions_cache'):
+            meta = self._container.source_meta()
+            if meta.get('width', None) is None:
+                return super(DiverseImageFieldFile,
+                             self)._get_image_dimensions()
+            self._dimensions_cache = (meta['width'], meta['height'],)
+        return self._dimensions_cache
+
     def thumbnail(self):
         thumbnail = self.field.thumbnail
         return thumbnail and getattr(self._container, thumbnail, None)
 
     @property
     def thumbnail_tag(self):
+        # do not generate thumbnail while rendering (changelists usually),
+        # src is direct url, redirect endpoint url (staff only, generates
+        # on request) is used only for lazy thumbnail, which is not known
+        # as generated (by cache)
         thumbnail = self.thumbnail()
-        return mark_safe(
-            '<img src="%s" alt="%s" />' % (thumbnail.url, thumbnail.url,)
-            if thumbnail else '[no thumbnail]')
+        if not thumbnail:
+            return mark_safe('[no thumbnail]')
+        url = thumbnail._get_url()
+        src = url
+        if getattr(thumbnail, 'ac_lazy', False) and not (
+                thumbnail._generated or thumbnail.is_cached()):
+            src = versions_url(self, self.field.thumbnail) or url
+        return mark_safe('<img src="%s" alt="%s" loading="lazy" />'
+                         % (src, url,))
+
+
+# file descriptors
+class DiverseFileDescriptorMixin(object):
+    def __set__(self, instance, value):
+        # remember initially assigned (loaded from db) file name,
+        # reassigning of file object of other instance (refresh_from_db)
+        # resets it, then value is updated in post_save after each saving;
+        # first assignment to deferred field of loaded instance is not
+        # loaded value, it is not tracked (name is queried on change)
+        ContainersCache.invalidate(instance, self.field)
+        if isinstance(value, FieldFile) and value.instance is not instance:
+            self.field.set_original_name(instance, value.name)
+        elif (self.field.attname in instance.__dict__ or
+              instance._state.db is None):
+            self.field.set_original_name(instance,
+                                         getattr(value, 'name', value),
+                                         force=False)
+        super(DiverseFileDescriptorMixin, self).__set__(instance, value)
+
+
+class DiverseFileDescriptor(DiverseFileDescriptorMixin, FileDescriptor):
+    pass
+
+
+class DiverseImageFileDescriptor(DiverseFileDescriptorMixin,
+                                 ImageFileDescriptor):
+    pass
 
 
 # file field
 class DiverseFileField(FileField):
     attr_class = DiverseFieldFile
+    descriptor_class = DiverseFileDescriptor
 
     def __init__(self, verbose_name=None, container=None,
                   clearable=False, updatable=False, erasable=False, **kwargs):
@@ -71,6 +172,7 @@ class DiverseFileField(FileField):
         errors = super(DiverseFileField, self).check(**kwargs)
         errors.extend(self._check_clearable())
         errors.extend(self._check_container())
+        errors.extend(self._check_cache())
         return errors
 
     def _check_clearable(self):
@@ -97,6 +199,23 @@ class DiverseFileField(FileField):
             ]
         return []
 
+    def _check_cache(self):
+        try:
+            cache = self.model._meta.get_field('%s_cache' % self.name)
+        except FieldDoesNotExist:
+            return []
+        if cache.get_internal_type() in ('CharField',):
+            return [
+                checks.Warning(
+                    'Cache field "%s" has limited length, versions data'
+                    ' may not fit into it.' % cache.name,
+                    hint='Use JSONField, BinaryField or TextField.',
+                    obj=self,
+                    id='diverse.fields.W001',
+                )
+            ]
+        return []
+
     def deconstruct(self):
         name, path, args, kwargs = super(DiverseFileField, self).deconstruct()
         # del kwargs['blank']
@@ -122,6 +241,36 @@ class DiverseFileField(FileField):
             instance.__diverse_update_actions__ = {}
         instance.__diverse_update_actions__[self.name] = value
 
+    # get/set file name, loaded from db (to erase it on change)
+    def get_original_name(self, instance):
+        """get tracked file name or query only this column as fallback"""
+        names = instance.__dict__.get('__diverse_original_names__', {})
+        if self.name in names and instance._state.db:
+            return names[self.name]
+        queryset = instance.__class__._default_manager.filter(pk=instance.pk)
+        return queryset.values_list(self.attname, flat=True).first()
+
+    def set_original_name(self, instance, value, force=True):
+        names = instance.__dict__.setdefault('__diverse_original_names__', {})
+        if force or self.name not in names:
+            names[self.name] = value
+
+    def get_original_holder(self, instance, name):
+        """
+        copy of instance with previous file name, its state dicts are
+        copied too, so erasing of previous file does not change instance
+        """
+
+        skip = ('__diverse_containers__', '__diverse_original_names__',)
+        orig = copy.copy(instance)
+        orig.__dict__ = dict((i, copy.copy(j) if isinstance(j, dict) else j,)
+                             for i, j in instance.__dict__.items()
+                             if i not in skip)
+        orig._state = copy.copy(instance._state)
+        orig._state.fields_cache = dict(instance._state.fields_cache)
+        setattr(orig, self.attname, name)
+        return orig
+
     def save_form_data(self, instance, data):
         if data == '__delete__' and self.blank and self.clearable:
             action = '__delete__'
@@ -147,9 +296,12 @@ class DiverseFileField(FileField):
             pass
         elif action == '__change__' and not add:
             # erase old file (or versions) before change if field is erasable
-            orig = instance.__class__.objects.filter(pk=instance.pk).first()
-            orig = getattr(orig, self.name, None)
-            orig and self._safe_erase(orig, instance, save=False)
+            # note: copy of instance is used as holder of previous file
+            name = self.get_original_name(instance)
+            if name:
+                orig = self.get_original_holder(instance, name)
+                self._safe_erase(getattr(orig, self.attname), orig,
+                                 save=False)
 
         return super(DiverseFileField, self).pre_save(instance, add)
 
@@ -168,14 +320,41 @@ class DiverseFileField(FileField):
     def post_save_handler(self, instance, **kwargs):
         action = self.get_action(instance)
         file = getattr(instance, self.attname)
-        if action in ('__update__', '__change__',):
-            if action == '__update__':
-                file._container.delete_versions()
-            elif action == '__change__':
-                file._container.change_original()
-            file._container.create_versions()
+        self.set_original_name(instance, file.name)
+        if action == '__update__':
+            # regenerate after deletion (it may be deferred by settings),
+            # in background it works with its own copy of row
+            container, using = file._container, instance._state.db
+            row = container.row()
+            callback = (
+                functools.partial(create_row_versions, *row)
+                if row and settings.DELETE_IN_BACKGROUND else
+                functools.partial(container.create_versions, using=using))
+            container.delete_versions(callback=callback, using=using)
+        elif action == '__change__':
+            container = file._container
+            container.change_original()
+            # metadata is written with row (it is set on file saving), but
+            # original is changed by "self" version processing and value of
+            # cache field, declared before file one, is taken before it
+            if container._version_original:
+                container.set_source_meta(commit=True)
+            elif self._cache_precedes(instance):
+                container.set_source_meta(container.source_meta(),
+                                          commit=True)
+            container.create_versions(using=instance._state.db)
+
+    def _cache_precedes(self, instance):
+        """check that cache field value is saved before file field one"""
+        fields = [i.name for i in instance._meta.concrete_fields]
+        cachefield = '%s_cache' % self.name
+        return (cachefield in fields and
+                fields.index(cachefield) < fields.index(self.name))
 
     def post_delete_handler(self, instance, **kwargs):
+        # files are erased in bulk by diverse.deletion.bulk_delete
+        if is_erase_suppressed(instance.__class__):
+            return
         file = getattr(instance, self.attname)
         self._safe_erase(file, instance, save=False)
 
@@ -206,6 +385,7 @@ class DiverseFileField(FileField):
 # image field
 class DiverseImageField(DiverseFileField, ImageField):
     attr_class = DiverseImageFieldFile
+    descriptor_class = DiverseImageFileDescriptor
 
     def __init__(self, verbose_name=None, thumbnail=None, **kwargs):
         super(DiverseImageField, self).__init__(verbose_name=verbose_name, **kwargs)
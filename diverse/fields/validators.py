@@ -5,6 +5,7 @@ from django.core.exceptions import ValidationError
 from django.db.models.fields.files import FieldFile
 from django.core.files.uploadedfile import UploadedFile
 from django.template.defaultfilters import filesizeformat
+from ..imageinfo import get_image_info
 
 
 def isuploaded(value, getfile=False):
@@ -123,3 +124,107 @@ class ExtensionValidator(BaseValidator):
             self.code == other.code and
             self.extensions == other.extensions
         )
+
+
+@deconstructible
+class MagicMimetypeValidator(MimetypeValidator):
+    """
+    Mimetype validator, which checks real file type by magic bytes,
+    instead of client-supplied content_type value.
+    """
+
+    code = 'magic_mimetype_validator'
+
+    def __call__(self, value):
+        value = isuploaded(value, getfile=True)
+        if not value:
+            return
+        info = get_image_info(value, max_frames=0)
+        mimetype = info and info.mimetype
+        if mimetype not in self.mimetypes:
+            raise ValidationError(
+                _('Filetype "%(curr)s" is not allowed. Available types - [%(list)s].')
+                % {'curr': mimetype or _('unknown'),
+                   'list': str(', '.join(self.mimetypes))},
+                code=self.code
+            )
+
+
+@deconstructible
+class ImageHeaderValidator(BaseValidator):
+    """
+    Image validator, which parses only image header (without decoding whole
+    image with PIL), so it is safe to check huge or spoofed files with it.
+    formats - allowed real formats (JPEG, PNG, GIF, WEBP, BMP, ...)
+    max_frames - max animation frames count (file is walked, not decoded)
+    """
+
+    code = 'image_header_validator'
+    limits = ('min_width', 'max_width', 'min_height', 'max_height',
+              'max_pixels', 'max_frames',)
+
+    def __init__(self, formats=None, min_width=None, max_width=None,
+                 min_height=None, max_height=None, max_pixels=None,
+                 max_frames=None):
+        if isinstance(formats, str):
+            formats = (formats,)
+        self.formats = formats and tuple(i.upper() for i in formats)
+        self.min_width, self.max_width = min_width, max_width
+        self.min_height, self.max_height = min_height, max_height
+        self.max_pixels, self.max_frames = max_pixels, max_frames
+
+    def __call__(self, value):
+        value = isuploaded(value, getfile=True)
+        if not value:
+            return
+
+        # frames are counted (file is walked) only if limit is set
+        info = get_image_info(value, max_frames=self.max_frames or 0)
+        if not info or not info.is_image or info.width is None:
+            raise ValidationError(
+                _('Upload a valid image. The file you uploaded was either'
+                  ' not an image or a corrupted image.'),
+                code=self.code
+            )
+        if self.formats and info.format not in self.formats:
+            raise ValidationError(
+                _('Image format "%(curr)s" is not allowed.'
+                  ' Available formats - [%(list)s].')
+                % {'curr': info.format, 'list': str(', '.join(self.formats))},
+                code=self.code
+            )
+
+        checks = (
+            (self.max_width, info.width, 1,
+             _('Please keep image width under %(limit)spx.'
+               ' Current width is %(real)spx.'),),
+            (self.min_width, info.width, -1,
+             _('Please keep image width above %(limit)spx.'
+               ' Current width is %(real)spx.'),),
+            (self.max_height, info.height, 1,
+             _('Please keep image height under %(limit)spx.'
+               ' Current height is %(real)spx.'),),
+            (self.min_height, info.height, -1,
+             _('Please keep image height above %(limit)spx.'
+               ' Current height is %(real)spx.'),),
+            (self.max_pixels, info.pixels, 1,
+             _('Please keep image pixels count under %(limit)s.'
+               ' Current pixels count is %(real)s.'),),
+            (self.max_frames, info.frames, 1,
+             _('Please keep animation frames count under %(limit)s.'),),
+        )
+        for limit, real, sign, message in checks:
+            if limit is not None and real is not None and (
+                    real > limit if sign > 0 else real < limit):
+                raise ValidationError(
+                    message % {'limit': limit, 'real': real,},
+                    code=self.code
+                )
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, self.__class__) and
+            self.code == other.code and
+            self.formats == other.formats and
+            all(getattr(self, i) == getattr(other, i) for i in self.limits)
+        )
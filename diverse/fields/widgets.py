@@ -1,10 +1,15 @@
 from django.utils.safestring import mark_safe
 from django.utils.translation import gettext as _
 from django import forms
+from ..views import versions_url
 
 
 class DiverseFileInput(forms.widgets.FileInput):
-    """A AdminFileWidget that shows versions, delete and update checkboxes."""
+    """
+    A AdminFileWidget that shows versions, delete and update checkboxes.
+    Note: versions are not generated while rendering, only deterministic urls
+          are shown, details are loaded on demand via diverse.urls endpoint.
+    """
     input_type = 'file'
 
     def __init__(self, attrs=None, show_version_links=True,
@@ -37,6 +42,22 @@ class DiverseFileInput(forms.widgets.FileInput):
             'versions': u"""<div style="display: inline;">
                 <a href="#" onclick="(function(elem){{
                     var ul = elem.parentNode.querySelector('ul');
+                    if (ul.dataset.url && !ul.dataset.loaded) {{
+                        ul.dataset.loaded = '1';
+                        fetch(ul.dataset.url, {{credentials: 'same-origin'}})
+                        .then(function(r) {{ return r.json(); }})
+                        .then(function(data) {{
+                            Object.keys(data.versions).forEach(function(k) {{
+                                var v = data.versions[k], info = [],
+                                    el = ul.querySelector(
+                                        '[data-version=\\'' + k + '\\']');
+                                if (!el) return;
+                                v.width && info.push(v.width + 'x' + v.height);
+                                v.size && info.push(v.size + ' B');
+                                el.textContent = info.join(', ');
+                            }});
+                        }});
+                    }}
                     if (ul.style.display == 'none') {{
                         ul.style.display = 'block';
                         elem.style.color = '#a41515';
@@ -47,10 +68,12 @@ class DiverseFileInput(forms.widgets.FileInput):
                         elem.style.fontWeight = null;
                     }}
                 }})(this); return false;">{title}</a>
-                <ul style="padding: 0; margin: 0; display: none;">{items}</ul>
+                <ul style="padding: 0; margin: 0; display: none;"
+                    data-url="{url}">{items}</ul>
             </div>""",
             'version': u"""<li>
                 {name}: <a href="{url}" target="_blank">{url}</a>
+                <span data-version="{key}"></span>
             </li>""",
         }
 
@@ -65,12 +88,14 @@ class DiverseFileInput(forms.widgets.FileInput):
             update_tag = html_tpls['update'].format(name=name,
                                                     title=_('Update'))
 
-        # generate versions
+        # generate versions (urls only, without generation and fs access)
         if self.show_version_links:
             versions_tag = html_tpls['versions'].format(
-                title=_('Versions'), items=u'\n'.join(
+                title=_('Versions'), url=versions_url(value) or u'',
+                items=u'\n'.join(
                     html_tpls['version'].format(
-                        url=value.dc.__getattr__(k)._get_url(), name=k.title())
+                        url=value.dc.__getattr__(k)._get_url(),
+                        name=k.title(), key=k)
                     for k in value.dc._versions.keys()
                 ),
             )
@@ -117,7 +142,7 @@ class DiverseImageFileInput(DiverseFileInput):
         tpls = super(DiverseImageFileInput, self).get_html_tpls(*args)
         tpls.update({
             'thumb': u"""<div style="float: left; margin: 0 10px 0 0;">
-                <img src="{url}" alt="{alt}" width="{width}" height="{height}">
+                <img src="{url}" alt="{alt}" loading="lazy">
             </div>""",
         })
         return tpls
@@ -126,13 +151,15 @@ class DiverseImageFileInput(DiverseFileInput):
         tags = super(DiverseImageFileInput,
                      self).get_html_tags(html_tpls, input, name, value, attrs)
 
-        # get thumbnail tag
+        # get thumbnail tag: src is redirect endpoint, which generates
+        # thumbnail on request, or direct url if endpoint is not available
         thumbnail = self.thumbnail and getattr(value._container,
                                                self.thumbnail, None)
         if thumbnail:
             img_tag = html_tpls['thumb'].format(
-                url=thumbnail.url, alt=thumbnail.name,
-                width=thumbnail.width, height=thumbnail.height)
+                url=(versions_url(value, self.thumbnail) or
+                     thumbnail._get_url()),
+                alt=thumbnail.name)
             tags = [html_tpls['open'], img_tag,] + tags + [html_tpls['close'],]
 
         return tags
@@ -1,7 +1,12 @@
 import os
+import threading
 import mimetypes
+from contextlib import contextmanager
 from django.core.files.images import get_image_dimensions
 from .settings import QUIET_OPERATION
+from .imageinfo import get_image_info, get_file_meta
+from .aio import run_sync
+from .layout import default_layout, move_file
 from .accessor import LazyPolicyAccessorMixin
 
 
@@ -20,7 +25,8 @@ class VersionFileBase(object):
 
     def __init__(self, attrname, source_file, processors,
                  filename=None, extension=None, storage=None,
-                 data=None, conveyor=None, accessor=None):
+                 data=None, conveyor=None, accessor=None, fingerprint=None,
+                 parent=None, layout=None):
         """
         attrname    - name of version file
         source_file - django db file instance
@@ -32,6 +38,11 @@ class VersionFileBase(object):
         storage     - django file storage instance
         data        - additional data (model, instance, ect.)
         accessor    - access policy configuration params
+        fingerprint - version spec hash (see BaseVersion.fingerprint)
+        parent      - source version file instance (for derived versions),
+                      it is processed instead of source_file
+        layout      - versions directory layout (see diverse.layout),
+                      it is used by default filename only
         """
 
         self.attrname = attrname
@@ -40,13 +51,18 @@ class VersionFileBase(object):
         self.accessor = accessor
 
         # attrs list working via getters
+        self._layout = layout or default_layout
+        self._layout_filename = not filename
         self._processors = (processors
-                            if isinstance(processors, list) else [processors])
+                            if isinstance(processors, (list, tuple,)) else
+                            [processors])
         self._filename = filename or self._default_filename()
         self._extension = (extension
                            if self._check_extension(extension) else None)
         self._conveyor = conveyor or self._conveyor
         self._storage = storage or source_file.storage
+        self._fingerprint = fingerprint
+        self._parent = parent
 
         # checks
         if not self._conveyor:
@@ -54,6 +70,10 @@ class VersionFileBase(object):
                              ' or by class property (_conveyor)).')
         # initial state
         self._attrs = {}
+        self._generation_lock = threading.RLock()
+        # metadata of last generation, filled by processors (for example,
+        # chosen encoding settings), see accessor attrs_meta
+        self.generation_meta = {}
 
     # laziness check in __getattr__ and post_source_save
     # version attrs get methods (_get_[name])
@@ -63,7 +83,7 @@ class VersionFileBase(object):
 
     def _get_mimetype(self):
         # unrelated method
-        return mimetypes.guess_type(self.path)[0]
+        return mimetypes.guess_type(self.name)[0]
 
     def _get_size(self):
         # related method
@@ -71,7 +91,7 @@ class VersionFileBase(object):
 
     # magic get/set methods
     def __setattr__(self, name, value):
-        if name in self.attrs_rel + self.attrs_unrel:
+        if name in self.attrs_rel or name in self.attrs_unrel:
             raise ValueError('You can\'t assign attributes named like'
                              ' attrs_rel(_unrel) entries.')
         super(VersionFileBase, self).__setattr__(name, value)
@@ -80,7 +100,7 @@ class VersionFileBase(object):
     #         overridable by accessor
     def __getattr__(self, name):
         # name in data related or unrelated keys
-        if name in self.attrs_rel + self.attrs_unrel:
+        if name in self.attrs_rel or name in self.attrs_unrel:
             # get from state
             value = self._attrs.get(name, None)
             # get real value and set to state
@@ -98,42 +118,117 @@ class VersionFileBase(object):
     def create(self, force=False):
         self.generate(force=force)
 
-    def delete(self):
-        self.storage().delete(self.name)
+    def delete(self, batch=None):
+        # reset state and delete file (or collect into deletion batch),
+        # file of fallback layout location is deleted too (if not moved)
+        self._generated, self._attrs = False, {}
+        self.generation_meta = {}
+        names = [self.filename(), self.fallback_filename(),]
+        for key in ('_name', '_path', '_dimensions_cache',):
+            self.__dict__.pop(key, None)
+        for name in filter(None, names):
+            if batch is not None:
+                batch.add(self.storage(), name)
+            else:
+                self.storage().delete(name)
+
+    # asyncio api: blocking operations run in bounded executor
+    async def aget(self, name):
+        """await version.aget('width') - async attribute getter"""
+        if name in self._attrs:
+            return self._attrs[name]
+        return await run_sync(getattr, self, name)
+
+    async def acreate(self, force=False):
+        return await run_sync(self.create, force=force)
+
+    async def adelete(self):
+        return await run_sync(self.delete)
 
     # version generation
     def generate(self, force=False):
         if self._generated and not force:
             return
-        try:
-            self.process(force=force)
-        except:
-            if not QUIET_OPERATION:
-                raise
-            return 1
-        self._generated = True
+        # versions may be generated concurrently (asyncio api, derived)
+        with self._generation_lock:
+            if self._generated and not force:
+                return
+            try:
+                self.process(force=force)
+            except BaseException as e:
+                if not QUIET_OPERATION:
+                    raise
+                self.generation_failed(e)
+                return 1
+            self._generated = True
+
+    def generation_failed(self, error):
+        """hook of swallowed (quiet mode) generation error"""
+        pass
 
     def process(self, force=False):
-        self.conveyor().run(self, force=force)
+        self.generation_meta = {}
+        try:
+            self.conveyor().run(self, force=force)
+        finally:
+            # file is in current layout location after generation, prepared
+            # result (see Conveyor.prepare) is used by one generation only
+            for key in ('_name', '_path', '_prepared',):
+                self.__dict__.pop(key, None)
 
     # attributes
     @property
     def name(self):
-        if not hasattr(self, '_name'):
-            self._name = self.filename()
+        if '_name' not in self.__dict__:
+            self._name = self.resolve_name()
         return self._name
 
+    def resolve_name(self):
+        """
+        get filename in current layout location or in fallback one while
+        file is not moved (one storage lookup if layout has fallback only,
+        see ShardedLayout), file is moved to current location on generation
+        """
+
+        name, previous = self.filename(), self.fallback_filename()
+        if previous and not self.storage().exists(name):
+            return previous
+        return name
+
+    def fallback_filename(self):
+        """get filename in fallback layout location (if it differs)"""
+        fallback = self._layout_filename and self._layout.fallback
+        if not fallback:
+            return None
+        previous = (fallback.filename(self.source_file.name, self.attrname)
+                    % self.extension())
+        return previous if previous != self.filename() else None
+
+    def restore_fallback(self, discard=False):
+        """
+        move file of fallback layout location (see ShardedLayout) to current
+        one, it is called on generation if file is missing in current one,
+        return True if file is moved (discard - delete it instead of moving)
+        """
+
+        previous = self.fallback_filename()
+        storage = self.storage()
+        if not previous or not storage.exists(previous):
+            return False
+        if discard:
+            storage.delete(previous)
+            return False
+        move_file(storage, previous, self.filename())
+        return True
+
     @property
     def path(self):
-        if not hasattr(self, '_path'):
+        if '_path' not in self.__dict__:
             self._path = self.storage().path(self.name)
         return self._path
 
     def _default_filename(self):
-        dirname, basename = os.path.split(self.source_file.name)
-        basename, extension = os.path.splitext(basename)
-        return '%sdcache/%s.%s%%s' % ('%s/' % dirname if dirname else '',
-                                      basename, self.attrname)
+        return self._layout.filename(self.source_file.name, self.attrname)
 
     # processors getter
     def processors(self):
@@ -155,9 +250,52 @@ class VersionFileBase(object):
     def storage(self):
         return self._storage
 
+    # spec fingerprint getter
+    def fingerprint(self):
+        return self._fingerprint
+
+    # parent (source version) getter
+    def parent(self):
+        return self._parent
+
+    # source file metadata getter (see BaseContainer.source_meta)
+    def source_meta(self):
+        """
+        metadata of original source file (not of parent version), taken
+        from container of source file or extracted from file once
+        """
+
+        if '_source_meta' not in self.__dict__:
+            container = getattr(self.source_file, '_container', None)
+            self._source_meta = (container.source_meta() if container else
+                                 get_file_meta(self.source_file))
+        return self._source_meta
+
+    @contextmanager
+    def process_source(self):
+        """
+        open file to process: source file or generated parent version file
+        (parent version is generated here if it is required)
+        """
+
+        parent = self.parent()
+        if parent:
+            if parent.generate():
+                raise ValueError('Source version "%s" is not available.'
+                                 % parent.attrname)
+            with parent.storage().open(parent.name, 'rb') as source:
+                yield source
+        else:
+            source_closed = self.source_file.closed
+            source_closed and self.source_file.open()
+            try:
+                yield self.source_file
+            finally:
+                source_closed and self.source_file.close()
+
     # fast no regexp is extension checking
     def _check_extension(self, value):
-        return (value and isinstance(value, basestring) and
+        return (value and isinstance(value, str) and
                 len(value) > 1 and value.startswith('.'))
 
     # getting suggested extension from processors or raise
@@ -168,8 +306,9 @@ class VersionFileBase(object):
             if not extension == ':same':
                 break
 
-        extension = (os.path.splitext(self.source_file.name)[1].lower()
-                     if extension == ':same' else extension)
+        if extension == ':same':
+            extension = (self.parent().extension() if self.parent() else
+                         os.path.splitext(self.source_file.name)[1].lower())
         if not extension or not (len(extension) > 1 and extension[0] == '.'):
             raise NotImplementedError(
                 'Extension method override required with processor:'
@@ -191,9 +330,16 @@ class VersionImageFileBase(VersionFileBase):
         return self._get_image_dimensions()[1]
 
     def _get_image_dimensions(self):
+        # read dimensions from header only, use PIL parser as fallback
         if not hasattr(self, '_dimensions_cache'):
             if 'image' in self.mimetype:
-                self._dimensions_cache = get_image_dimensions(self.path)
+                # storage may be not local (without path)
+                with self.storage().open(self.name, 'rb') as fp:
+                    info = get_image_info(fp, max_frames=0)
+                    self._dimensions_cache = (
+                        [info.width, info.height,]
+                        if info and info.width is not None else
+                        get_image_dimensions(fp))
             else:
                 self._dimensions_cache = [None, None,]
         return self._dimensions_cache
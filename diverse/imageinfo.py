@@ -0,0 +1,344 @@
+"""
+Header-only file type and image info detection (without PIL).
+
+Only first bytes of file are read to sniff the real format by magic bytes
+and to parse image dimensions, colour mode and EXIF orientation, animation
+frames are counted by skipping data blocks (seek only, without decoding).
+"""
+import struct
+
+# size of data, readed at once while sniffing and parsing header
+HEADER_SIZE = 8 * 1024
+
+# (offset, magic bytes, format, mimetype) - order matters
+SIGNATURES = (
+    (0, b'\xff\xd8\xff', 'JPEG', 'image/jpeg',),
+    (0, b'\x89PNG\r\n\x1a\n', 'PNG', 'image/png',),
+    (0, b'GIF87a', 'GIF', 'image/gif',),
+    (0, b'GIF89a', 'GIF', 'image/gif',),
+    (8, b'WEBP', 'WEBP', 'image/webp',),
+    (0, b'BM', 'BMP', 'image/bmp',),
+    (0, b'II*\x00', 'TIFF', 'image/tiff',),
+    (0, b'MM\x00*', 'TIFF', 'image/tiff',),
+    (0, b'%PDF-', 'PDF', 'application/pdf',),
+    (0, b'PK\x03\x04', 'ZIP', 'application/zip',),
+    (0, b'\x1f\x8b', 'GZIP', 'application/gzip',),
+)
+
+# (offset, magic bytes) of container, required by format in addition
+SIGNATURE_CONTAINERS = {
+    'WEBP': (0, b'RIFF',),
+}
+
+# dib header sizes of bmp (core, info, v2, v3, os/2 v2, v4 and v5 ones)
+BMP_DIB_HEADER_SIZES = frozenset((12, 40, 52, 56, 64, 108, 124,))
+
+# exif orientation tag (tiff ifd0 entry)
+EXIF_ORIENTATION_TAG = 0x0112
+
+# jpeg start of frame markers (dimensions holders)
+JPEG_SOF_MARKERS = frozenset((0xc0, 0xc1, 0xc2, 0xc3, 0xc5, 0xc6, 0xc7,
+                              0xc9, 0xca, 0xcb, 0xcd, 0xce, 0xcf,))
+
+
+class ImageInfo(object):
+    """
+    real file format info, dimensions, colour mode (PIL names) and
+    orientation (EXIF value, 1 is normal) are None if unknown
+    """
+
+    keys = ('format', 'mimetype', 'width', 'height', 'frames',
+            'orientation', 'mode',)
+
+    def __init__(self, format, mimetype, width=None, height=None, frames=1,
+                 orientation=None, mode=None):
+        self.format, self.mimetype = format, mimetype
+        self.width, self.height = width, height
+        self.frames = frames
+        self.orientation, self.mode = orientation, mode
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**dict((i, data.get(i, None),) for i in cls.keys))
+
+    def as_dict(self):
+        return dict((i, getattr(self, i),) for i in self.keys)
+
+    @property
+    def is_image(self):
+        return self.mimetype.startswith('image/')
+
+    @property
+    def pixels(self):
+        return (self.width * self.height
+                if self.width is not None and self.height is not None else
+                None)
+
+    def __repr__(self):
+        return '<ImageInfo: %s %sx%s, %s frame(s)>' % (
+            self.format, self.width, self.height, self.frames,)
+
+
+def sniff(header):
+    """get (format, mimetype) by magic bytes or (None, None)"""
+    for offset, magic, format, mimetype in SIGNATURES:
+        if header[offset:offset+len(magic)] == magic:
+            container = SIGNATURE_CONTAINERS.get(format, None)
+            if container and header[container[0]:container[0] +
+                                    len(container[1])] != container[1]:
+                continue
+            check = SIGNATURE_CHECKS.get(format, None)
+            if check and not check(header):
+                continue
+            return format, mimetype
+    return None, None
+
+
+def _check_bmp(header):
+    """
+    two bytes magic is too short (text files may start with "BM"): file
+    size, pixel data offset and dib header size fields should be consistent
+    """
+
+    if len(header) < 18:
+        return False
+    size, offset, dib = struct.unpack('<I4xII', header[2:18])
+    return dib in BMP_DIB_HEADER_SIZES and 14 + dib <= offset <= size
+
+
+# format specific header checks, required in addition to magic bytes
+SIGNATURE_CHECKS = {
+    'BMP': _check_bmp,
+}
+
+
+def get_image_info(file, max_frames=1):
+    """
+    file       - file-like object (seekable) or local filesystem path
+    max_frames - stop frames counting after this value is exceeded, so
+                 frames value is not greater than max_frames + 1 (default
+                 1 - animated or not, file is walked up to second frame),
+                 0 - header only (frames are not counted, value is 1),
+                 None - count all (whole file is walked, it is slow for
+                 long animations)
+    return ImageInfo instance or None if format is unknown,
+    file position is restored after reading
+    """
+
+    if isinstance(file, str):
+        with open(file, 'rb') as fp:
+            return get_image_info(fp, max_frames=max_frames)
+
+    position = file.tell()
+    try:
+        file.seek(0)
+        header = file.read(HEADER_SIZE)
+        format, mimetype = sniff(header)
+        if not format:
+            return None
+
+        info = ImageInfo(format, mimetype)
+        parser = PARSERS.get(format, None)
+        if parser:
+            try:
+                parser(file, header, info, max_frames)
+            except (struct.error, IndexError, ValueError):
+                # truncated or broken header: dimensions are unknown
+                pass
+        return info
+    finally:
+        file.seek(position)
+
+
+# parsers: fill info from header or by reading file (with seeking)
+def _read_exact(file, offset, size):
+    file.seek(offset)
+    data = file.read(size)
+    if len(data) < size:
+        raise ValueError('Unexpected end of file.')
+    return data
+
+
+def _exif_orientation(data):
+    """get orientation from exif data (tiff header and ifd0) or None"""
+    if data.startswith(b'Exif\x00\x00'):
+        data = data[6:]
+    order = {b'II': '<', b'MM': '>'}.get(data[:2], None)
+    if not order:
+        return None
+    offset = struct.unpack(order + 'I', data[4:8])[0]
+    count = struct.unpack(order + 'H', data[offset:offset+2])[0]
+    for index in range(count):
+        entry = offset + 2 + index * 12
+        tag, type = struct.unpack(order + 'HH', data[entry:entry+4])
+        if tag == EXIF_ORIENTATION_TAG and type == 3:
+            value = struct.unpack(order + 'H', data[entry+8:entry+10])[0]
+            return value if 1 <= value <= 8 else None
+    return None
+
+
+def _parse_jpeg(file, header, info, max_frames):
+    offset = 2
+    while True:
+        marker = _read_exact(file, offset, 4)
+        if marker[0] != 0xff:
+            raise ValueError('Invalid JPEG marker.')
+        if marker[1] == 0xff:
+            # fill bytes before marker
+            offset += 1
+            continue
+        if marker[1] in (0xd9, 0xda,):
+            # end of image or start of scan without frame header
+            raise ValueError('JPEG frame header not found.')
+        length = struct.unpack('>H', marker[2:4])[0]
+        if (marker[1] == 0xe1 and info.orientation is None and
+                _read_exact(file, offset + 4, 6) == b'Exif\x00\x00'):
+            # app1 segment with exif data (not xmp)
+            data = _read_exact(file, offset + 10, length - 8)
+            try:
+                info.orientation = _exif_orientation(data)
+            except struct.error:
+                pass
+        if marker[1] in JPEG_SOF_MARKERS:
+            data = _read_exact(file, offset + 5, 5)
+            info.height, info.width, components = struct.unpack('>HHB',
+                                                                data)
+            info.mode = {1: 'L', 3: 'RGB', 4: 'CMYK'}.get(components, None)
+            return
+        offset += 2 + length
+
+
+def _parse_png(file, header, info, max_frames):
+    info.width, info.height = struct.unpack('>II', header[16:24])
+    depth, color = header[24], header[25]
+    info.mode = ({1: '1', 16: 'I'}.get(depth, 'L') if color == 0 else
+                 {2: 'RGB', 3: 'P', 4: 'LA', 6: 'RGBA'}.get(color, None))
+
+    # walk chunks until image data to find animation control and exif
+    offset = 8
+    while True:
+        length, ctype = struct.unpack('>I4s', _read_exact(file, offset, 8))
+        if ctype == b'acTL':
+            info.frames = struct.unpack('>I', _read_exact(file,
+                                                          offset + 8, 4))[0]
+        elif ctype == b'eXIf':
+            info.orientation = _exif_orientation(
+                _read_exact(file, offset + 8, length))
+        elif ctype in (b'IDAT', b'IEND',):
+            return
+        offset += 12 + length
+
+
+def _parse_gif(file, header, info, max_frames):
+    info.width, info.height = struct.unpack('<HH', header[6:10])
+    info.mode = 'P'
+    offset = 13
+    if header[10] & 0x80:
+        offset += 3 * (2 << (header[10] & 0x07))
+
+    def skip_subblocks(offset):
+        while True:
+            size = _read_exact(file, offset, 1)[0]
+            offset += 1 + size
+            if not size:
+                return offset
+
+    if max_frames == 0:
+        return
+    frames = 0
+    while True:
+        block = _read_exact(file, offset, 1)[0]
+        if block == 0x3b:
+            # trailer
+            break
+        elif block == 0x21:
+            # extension: label and data sub-blocks
+            offset = skip_subblocks(offset + 2)
+        elif block == 0x2c:
+            # image descriptor, local color table, lzw code size, data
+            frames += 1
+            if max_frames is not None and frames > max_frames:
+                break
+            flags = _read_exact(file, offset + 9, 1)[0]
+            offset += 10
+            if flags & 0x80:
+                offset += 3 * (2 << (flags & 0x07))
+            offset = skip_subblocks(offset + 1)
+        else:
+            raise ValueError('Invalid GIF block.')
+    info.frames = frames
+
+
+def _parse_webp(file, header, info, max_frames):
+    ctype, data = header[12:16], header[20:30]
+    if ctype == b'VP8 ':
+        w, h = struct.unpack('<HH', data[6:10])
+        info.width, info.height = w & 0x3fff, h & 0x3fff
+        info.mode = 'RGB'
+    elif ctype == b'VP8L':
+        bits = struct.unpack('<I', data[1:5])[0]
+        info.width = (bits & 0x3fff) + 1
+        info.height = ((bits >> 14) & 0x3fff) + 1
+        info.mode = 'RGBA' if bits & (1 << 28) else 'RGB'
+    elif ctype == b'VP8X':
+        info.width = int.from_bytes(data[4:7], 'little') + 1
+        info.height = int.from_bytes(data[7:10], 'little') + 1
+        info.mode = 'RGBA' if data[0] & 0x10 else 'RGB'
+        animated, exif = data[0] & 0x02, data[0] & 0x08
+        if (animated and max_frames != 0) or exif:
+            # walk chunks: count frames of animated and find exif chunk
+            frames, offset = 0, 12
+            while True:
+                file.seek(offset)
+                chunk = file.read(8)
+                if len(chunk) < 8:
+                    break
+                ctype, length = struct.unpack('<4sI', chunk)
+                if ctype == b'ANMF':
+                    frames += 1
+                    if max_frames is not None and frames > max_frames:
+                        break
+                elif ctype == b'EXIF':
+                    info.orientation = _exif_orientation(
+                        _read_exact(file, offset + 8, length))
+                    if not animated:
+                        break
+                offset += 8 + length + (length & 1)
+            if animated and max_frames != 0:
+                info.frames = frames
+
+
+def _parse_bmp(file, header, info, max_frames):
+    width, height = struct.unpack('<ii', header[18:26])
+    info.width, info.height = width, abs(height)
+    bits = struct.unpack('<H', header[28:30])[0]
+    info.mode = {1: '1', 4: 'P', 8: 'P', 16: 'RGB', 24: 'RGB',
+                 32: 'RGB'}.get(bits, None)
+
+
+PARSERS = {
+    'JPEG': _parse_jpeg,
+    'PNG': _parse_png,
+    'GIF': _parse_gif,
+    'WEBP': _parse_webp,
+    'BMP': _parse_bmp,
+}
+
+
+def get_file_meta(file):
+    """
+    get metadata dict (see ImageInfo.as_dict) of django file (it is opened
+    if closed and closed back) or empty dict if format is unknown
+    """
+
+    closed = file.closed
+    try:
+        closed and file.open('rb')
+        try:
+            # frames are counted up to 2 (animated or not)
+            info = get_image_info(file, max_frames=1)
+        finally:
+            closed and file.close()
+    except (OSError, ValueError):
+        return {}
+    return info.as_dict() if info else {}
@@ -0,0 +1,73 @@
+import os
+import hashlib
+from django.core.files.storage import FileSystemStorage
+
+# name of versions directory
+VERSIONS_DIRNAME = 'dcache'
+
+
+class FlatLayout(object):
+    """
+    Default versions layout: all versions of files of one directory are in
+    its "dcache" subdirectory (dir/dcache/<basename>.<attrname>.<ext>).
+    """
+
+    # layout of previous location of files (see ShardedLayout)
+    fallback = None
+
+    def filename(self, source_name, attrname):
+        """get filename pattern with one %s key for extension"""
+        dirname, basename = os.path.split(source_name)
+        basename, extension = os.path.splitext(basename)
+        return '%s%s/%s.%s%%s' % ('%s/' % dirname if dirname else '',
+                                  VERSIONS_DIRNAME, basename, attrname)
+
+
+class ShardedLayout(FlatLayout):
+    """
+    Versions are spread into nested subdirectories of "dcache" by hash of
+    source file name (dir/dcache/ab/cd/<basename>.<attrname>.<ext>).
+    depth    - count of nested shard directories
+    width    - count of hex chars of each shard directory name
+    fallback - layout of existing files (versions are read from previous
+               location while file is not moved, it is moved to current
+               one on version generation, see diverse_migrate_layout
+               command to move all files), set it to None after migration
+               is completed (to skip lookups of current location)
+    """
+
+    def __init__(self, depth=2, width=2, fallback=FlatLayout()):
+        if depth < 1 or width < 1 or depth * width > 32:
+            raise ValueError('Shards depth and width should be positive'
+                             ' and less than md5 hexdigest in total.')
+        self.depth, self.width = depth, width
+        self.fallback = fallback
+
+    def shards(self, source_name):
+        digest = hashlib.md5(source_name.encode('utf-8')).hexdigest()
+        return '/'.join(digest[i * self.width:(i + 1) * self.width]
+                        for i in range(self.depth))
+
+    def filename(self, source_name, attrname):
+        dirname, basename = os.path.split(source_name)
+        basename, extension = os.path.splitext(basename)
+        return '%s%s/%s/%s.%s%%s' % ('%s/' % dirname if dirname else '',
+                                     VERSIONS_DIRNAME,
+                                     self.shards(source_name),
+                                     basename, attrname)
+
+
+def move_file(storage, previous, name):
+    """move file of storage to new name (rename for local storage)"""
+    if isinstance(storage, FileSystemStorage):
+        path = storage.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(storage.path(previous), path)
+    else:
+        with storage.open(previous) as fp:
+            storage.save(name, fp)
+        storage.delete(previous)
+
+
+# default layout instance
+default_layout = FlatLayout()
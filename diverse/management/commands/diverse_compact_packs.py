@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.template.defaultfilters import filesizeformat
+from django.utils.module_loading import import_string
+from diverse.storages import PackStorage
+
+
+class Command(BaseCommand):
+    help = ('Reclaim space of deleted files in pack storage: live files of'
+            ' packs with enough dead bytes are moved into writable pack and'
+            ' old packs are removed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'storages', nargs='+', metavar='storage.dotted.path',
+            help='Pack storage instances (module attributes).')
+        parser.add_argument(
+            '--min-dead-ratio', type=float, default=0.3,
+            help='Compact packs with dead bytes ratio not less than value.')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report packs usage.')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        for path in options['storages']:
+            try:
+                storage = import_string(path)
+            except ImportError as e:
+                raise CommandError('Storage import error: %s' % e)
+            if not isinstance(storage, PackStorage):
+                raise CommandError('"%s" is not a pack storage.' % path)
+
+            usage = storage.usage()
+            for pack, (size, live) in sorted(usage.items()):
+                self.log('%s: pack %s, size %s, dead %s.' % (
+                    path, pack, filesizeformat(size),
+                    filesizeformat(size - live)), 2)
+            total = sum(i[0] for i in usage.values())
+            dead = sum(i[0] - i[1] for i in usage.values())
+            self.log('%s: %s packs, size %s, dead %s.' % (
+                path, len(usage), filesizeformat(total),
+                filesizeformat(dead)), 1)
+
+            if not options['dry_run']:
+                reclaimed = storage.compact(options['min_dead_ratio'])
+                self.log('%s: reclaimed %s.' % (path,
+                                               filesizeformat(reclaimed)), 1)
+
+    def log(self, message, verbosity=1):
+        self.verbosity >= verbosity and self.stdout.write(message)
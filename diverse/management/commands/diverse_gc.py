@@ -0,0 +1,144 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+from diverse import settings
+from diverse.layout import VERSIONS_DIRNAME
+from diverse.management.utils import get_diverse_fields, iterate_instances
+
+
+class Command(BaseCommand):
+    help = ('Find and delete orphaned version files (files in "%s"'
+            ' directories of local storages, which are not expected by any'
+            ' diverse field value and its container).' % VERSIONS_DIRNAME)
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'labels', nargs='*', metavar='app_label[.Model[.field]]',
+            help='Diverse fields to process (all by default).')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report orphans, do not delete them.')
+        parser.add_argument(
+            '--workers', type=int, default=settings.WORKERS,
+            help='Count of directory scanning threads.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Count of rows fetched from database at once.')
+        parser.add_argument(
+            '--rate', type=float, default=None,
+            help='Max count of deleted files per second.')
+        parser.add_argument(
+            '--min-age', type=int, default=3600,
+            help='Skip files modified less than this seconds ago'
+                 ' (created after expected names collecting, usually).')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        # expected names are collected always from all diverse fields
+        # (storages may be shared), labels limit scanned storages only
+        fields = get_diverse_fields(options['labels'])
+        expected = self.collect(get_diverse_fields(), options['chunk_size'])
+        roots = self.get_roots(fields)
+        self.log('Expected version files: %s.' % len(expected), 2)
+
+        threshold = time.time() - options['min_age']
+        orphans = [i for i in self.scan(roots, options['workers'])
+                   if i[0] not in expected and i[2] < threshold]
+        size = sum(i[1] for i in orphans)
+
+        deleted, reclaimed = 0, 0
+        if not options['dry_run']:
+            deleted, reclaimed = self.delete(orphans, options['rate'])
+
+        self.log('Orphaned version files: %s (%s).'
+                 % (len(orphans), filesizeformat(size)), 1)
+        if not options['dry_run']:
+            self.log('Deleted files: %s, reclaimed: %s.'
+                     % (deleted, filesizeformat(reclaimed)), 1)
+
+    def log(self, message, verbosity=1):
+        self.verbosity >= verbosity and self.stdout.write(message)
+
+    def collect(self, fields, chunk_size):
+        """collect expected version files paths by streaming field values"""
+
+        expected = set()
+        for model, field in fields:
+            self.log('Collecting %s.%s.%s versions.'
+                     % (model._meta.app_label, model.__name__, field.name), 2)
+            for instance in iterate_instances(model, field, chunk_size):
+                file = getattr(instance, field.attname)
+                for name in file._container._versions.keys():
+                    version = getattr(file._container, name)
+                    storage = version.storage()
+                    if not isinstance(storage, FileSystemStorage):
+                        continue
+                    # file of fallback layout location is expected too
+                    # (it is not moved yet, see diverse_migrate_layout)
+                    names = [version.filename(), version.fallback_filename(),]
+                    expected.update(storage.path(i) for i in names if i)
+        return expected
+
+    def get_roots(self, fields):
+        """get not nested locations of local storages of fields versions"""
+        roots = set()
+        for model, field in fields:
+            container = field.container
+            storages = [field.storage] + [
+                i.storage for i in container._versions.values() if i.storage]
+            roots.update(os.path.abspath(i.location) for i in storages
+                         if isinstance(i, FileSystemStorage))
+        return [i for i in roots
+                if not any(i.startswith(j + os.sep) for j in roots)]
+
+    def scan(self, roots, workers):
+        """
+        scan roots in parallel (one scandir task per directory), return
+        list of (path, size, mtime) of each file inside versions directories
+        """
+
+        def scandir(path, inside):
+            dirs, files = [], []
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            dirs.append((entry.path, inside or
+                                         entry.name == VERSIONS_DIRNAME,))
+                        elif inside and entry.is_file(follow_symlinks=False):
+                            stat = entry.stat(follow_symlinks=False)
+                            files.append((entry.path, stat.st_size,
+                                          stat.st_mtime,))
+            except (FileNotFoundError, PermissionError):
+                pass
+            return dirs, files
+
+        result = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = set(executor.submit(scandir, i, False) for i in roots)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    dirs, files = future.result()
+                    result.extend(files)
+                    pending.update(executor.submit(scandir, *i)
+                                   for i in dirs)
+        return result
+
+    def delete(self, orphans, rate=None):
+        deleted, reclaimed = 0, 0
+        interval = 1.0 / rate if rate else 0
+        for path, size, mtime in orphans:
+            started = time.monotonic()
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                continue
+            deleted, reclaimed = deleted + 1, reclaimed + size
+            self.log('Deleted: %s' % path, 3)
+            interval and time.sleep(
+                max(0, interval - (time.monotonic() - started)))
+        return deleted, reclaimed
@@ -0,0 +1,120 @@
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from diverse import settings
+from diverse.layout import move_file
+from diverse.management.utils import get_diverse_fields, iterate_instances
+
+
+class Command(BaseCommand):
+    help = ('Move existing version files from fallback layout location to'
+            ' current one (see diverse.layout.ShardedLayout), versions are'
+            ' read from fallback location until they are moved. Progress'
+            ' is saved to state file, so interrupted migration is resumed.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'labels', nargs='*', metavar='app_label[.Model[.field]]',
+            help='Diverse fields to process (all by default).')
+        parser.add_argument(
+            '--workers', type=int, default=settings.WORKERS,
+            help='Count of file moving threads.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Count of rows processed (and saved to state) at once.')
+        parser.add_argument(
+            '--state', default=os.path.join(settings.TEMPORARY_DIR,
+                                            'diverse_migrate_layout.json'),
+            help='Path of state file (last processed primary keys).')
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Ignore saved state, process all rows from start.')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report files to move, do not move them.')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        self.dry_run = options['dry_run']
+        self.state_path = options['state']
+        state = {} if options['restart'] else self.load_state()
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for model, field in get_diverse_fields(options['labels']):
+                label = '%s.%s.%s' % (model._meta.app_label,
+                                      model.__name__, field.name)
+                if not self.has_fallback(field.container):
+                    self.log('Skip %s: there is no fallback layout.'
+                             % label, 2)
+                    continue
+                moved = self.migrate(model, field, label, state,
+                                     options['chunk_size'], executor)
+                self.log('%s: %s files %s.' % (
+                    label, moved, 'to move' if self.dry_run else 'moved'), 1)
+
+    def log(self, message, verbosity=1):
+        self.verbosity >= verbosity and self.stdout.write(message)
+
+    def load_state(self):
+        try:
+            with open(self.state_path) as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return {}
+
+    def save_state(self, state):
+        if self.dry_run:
+            return
+        temppath = '%s.tmp' % self.state_path
+        with open(temppath, 'w') as fp:
+            json.dump(state, fp)
+        os.replace(temppath, self.state_path)
+
+    def has_fallback(self, container):
+        # instance specific containers (get_container_for_<field>) are
+        # unknown, so they are processed always
+        return not container or any(
+            i.layout and i.layout.fallback and not i.filename
+            for i in container._versions.values())
+
+    def migrate(self, model, field, label, state, chunk_size, executor):
+        instances = iterate_instances(model, field, chunk_size,
+                                      after_pk=state.get(label, None))
+        moved, pairs, last = 0, [], None
+        for instance in instances:
+            file = getattr(instance, field.attname)
+            for name in file._container._versions.keys():
+                version = getattr(file._container, name)
+                previous = version.fallback_filename()
+                if previous:
+                    pairs.append((version.storage(), previous,
+                                  version.filename(),))
+            last = instance.pk
+            if len(pairs) >= chunk_size:
+                moved += sum(executor.map(self.move, pairs))
+                pairs, state[label] = [], last
+                self.save_state(state)
+
+        moved += sum(executor.map(self.move, pairs))
+        if last is not None:
+            state[label] = last
+            self.save_state(state)
+        return moved
+
+    def move(self, item):
+        """move file to current location, return 1 if it is moved"""
+        storage, previous, name = item
+        if not storage.exists(previous):
+            return 0
+        if self.dry_run:
+            self.log('%s -> %s' % (previous, name), 3)
+            return 1
+
+        if storage.exists(name):
+            # version is generated in current location already
+            storage.delete(previous)
+            return 0
+        move_file(storage, previous, name)
+        self.log('%s -> %s' % (previous, name), 3)
+        return 1
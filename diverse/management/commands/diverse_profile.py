@@ -0,0 +1,167 @@
+import os
+import json
+import shutil
+import cProfile
+import tempfile
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+from diverse.container import BaseContainer
+from diverse.profiling import StageProfiler, ScratchFile
+
+
+class Command(BaseCommand):
+    help = ('Run versions of container against sample files with real'
+            ' conveyor and scratch storage, report wall time, cpu time and'
+            ' memory peak (tracemalloc) of each stage and processor.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'container', metavar='container.dotted.Path',
+            help='Container class to profile.')
+        parser.add_argument(
+            'files', nargs='+', metavar='file',
+            help='Sample source files.')
+        parser.add_argument(
+            '--versions', default=None,
+            help='Comma separated names of versions to profile (with "self"'
+                 ' version if it is defined, source versions are processed'
+                 ' anyway).')
+        parser.add_argument(
+            '--repeat', type=int, default=1,
+            help='Count of runs for each file.')
+        parser.add_argument(
+            '--no-memory', action='store_true',
+            help='Do not trace memory (tracemalloc slows processing down).')
+        parser.add_argument(
+            '--json', default=None, metavar='PATH',
+            help='Write results as json to file ("-" for stdout).')
+        parser.add_argument(
+            '--cprofile', default=None, metavar='PATH',
+            help='Dump cProfile stats of all runs to file.')
+
+    def handle(self, *args, **options):
+        try:
+            container = import_string(options['container'])
+        except ImportError as e:
+            raise CommandError('Container import error: %s' % e)
+        if not (isinstance(container, type) and
+                issubclass(container, BaseContainer)):
+            raise CommandError('"%s" is not a container class.'
+                               % options['container'])
+        for path in options['files']:
+            if not os.path.isfile(path):
+                raise CommandError('File "%s" does not exist.' % path)
+
+        versions = options['versions'] and options['versions'].split(',')
+        unknown = [i for i in versions or []
+                   if i not in container._versions and i != 'self']
+        if unknown:
+            raise CommandError('Unknown versions: %s.' % ', '.join(unknown))
+
+        profile = cProfile.Profile() if options['cprofile'] else None
+        results = []
+        for path in options['files']:
+            profiler = StageProfiler(memory=not options['no_memory'])
+            errors = {}
+            with profiler:
+                for index in range(max(1, options['repeat'])):
+                    errors.update(self.run(container, path, versions,
+                                           profiler, profile))
+            results.append({'file': path, 'runs': max(1, options['repeat']),
+                            'stages': profiler.results(), 'errors': errors})
+
+        if profile:
+            profile.dump_stats(options['cprofile'])
+        if options['json']:
+            self.write_json(results, options['json'])
+        if options['json'] != '-':
+            for result in results:
+                self.print_table(result)
+
+    def versions(self, container, names=None):
+        """names of versions to process in order (with required sources)"""
+        order = container._versions_order
+        if names:
+            required = set(names)
+            for name in order[::-1]:
+                if name in required and container._versions[name].source:
+                    required.add(container._versions[name].source)
+            order = [i for i in order if i in required]
+        if container._version_original and (not names or 'self' in names):
+            order = ['self'] + order
+        return order
+
+    def run(self, container, path, names, profiler, profile=None):
+        """process all versions of file once, return errors by versions"""
+
+        errors = {}
+        location = tempfile.mkdtemp(prefix='diverse_profile_')
+        try:
+            storage = FileSystemStorage(location=location)
+            with open(path, 'rb') as fp:
+                source_name = storage.save(os.path.basename(path), fp)
+            source_file = ScratchFile(storage, source_name)
+
+            files = {}
+            for name in self.versions(container, names):
+                version = (container._version_original if name == 'self'
+                           else container._versions[name])
+                parent = files.get(version.source) if name != 'self' else None
+                if version.source and name != 'self' and parent is None:
+                    errors[name] = 'source version is not available'
+                    continue
+
+                cls, args, kwargs = version.version(
+                    source_file, instantiate=False, parent=parent)
+                # versions are saved only to scratch storage without cache
+                kwargs.update(storage=storage, accessor=dict(
+                    kwargs.get('accessor') or {}, cache=None))
+                if name == 'self':
+                    kwargs.update(filename='%s%%s' % os.path.splitext(
+                        source_file.name)[0])
+                versionfile = cls(*args, **kwargs)
+
+                profile and profile.enable()
+                try:
+                    with profiler.stage(name):
+                        failed = versionfile.generate(force=True)
+                except Exception as e:
+                    failed, errors[name] = True, repr(e)
+                finally:
+                    profile and profile.disable()
+
+                if failed:
+                    errors.setdefault(name, 'generation failed (quiet mode)')
+                else:
+                    files[name] = versionfile
+        finally:
+            shutil.rmtree(location, ignore_errors=True)
+        return errors
+
+    def write_json(self, results, path):
+        data = json.dumps(results, indent=2)
+        if path == '-':
+            self.stdout.write(data)
+        else:
+            with open(path, 'w') as fp:
+                fp.write(data)
+
+    def print_table(self, result):
+        runs = result['runs']
+        self.stdout.write('%s (runs: %s, values per run)' % (result['file'],
+                                                             runs))
+        header = ('stage', 'calls', 'wall ms', 'cpu ms', 'peak KiB')
+        rows = [(i['stage'], '%g' % (i['calls'] / float(runs)),
+                 '%.2f' % (i['wall'] * 1000 / runs),
+                 '%.2f' % (i['cpu'] * 1000 / runs),
+                 '%.1f' % (i['peak'] / 1024.0))
+                for i in result['stages']]
+        widths = [max(len(str(j[i])) for j in [header] + rows)
+                  for i in range(len(header))]
+        for row in [header] + rows:
+            self.stdout.write('  ' + '  '.join(
+                (str(j).ljust if not i else str(j).rjust)(widths[i])
+                for i, j in enumerate(row)))
+        for name, error in sorted(result['errors'].items()):
+            self.stderr.write('  %s: %s' % (name, error))
@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand
+from diverse.container import update_versions_batch
+from diverse.management.utils import get_diverse_fields, iterate_instances
+
+
+class Command(BaseCommand):
+    help = ('Regenerate versions of diverse fields, which spec fingerprint'
+            ' (processors, options, format) differs from cached one.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'labels', nargs='*', metavar='app_label[.Model[.field]]',
+            help='Diverse fields to process (all by default).')
+        parser.add_argument(
+            '--versions', default=None,
+            help='Comma separated names of versions to process.')
+        parser.add_argument(
+            '--missing', action='store_true',
+            help='Regenerate versions without cached fingerprint too (lazy'
+                 ' versions cache it only after generation on demand).')
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Regenerate all versions (ignore fingerprints).')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report stale versions, do not regenerate them.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Count of rows fetched from database at once.')
+        parser.add_argument(
+            '--batch-size', type=int, default=0,
+            help='Count of instances, which versions are regenerated'
+                 ' together: numpy processors process same-size images of'
+                 ' version at once (0 - one by one).')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        versions = options['versions'] and options['versions'].split(',')
+
+        for model, field in get_diverse_fields(options['labels']):
+            counts = {}
+            cachefield = [i.name for i in model._meta.fields
+                          if i.name == '%s_cache' % field.name]
+            instances = iterate_instances(model, field, options['chunk_size'],
+                                          only=cachefield)
+            pending = []
+            for instance in instances:
+                container = getattr(instance, field.attname)._container
+                names = (list(container._versions.keys()) if options['all']
+                         else container.stale_versions(options['missing']))
+                names = [i for i in names if not versions or i in versions]
+                if not names:
+                    continue
+                if options['dry_run']:
+                    pass
+                elif options['batch_size'] > 1:
+                    pending.append((container, names,))
+                    if len(pending) >= options['batch_size']:
+                        update_versions_batch(pending)
+                        pending = []
+                else:
+                    container.update_versions(names)
+                for name in names:
+                    counts[name] = counts.get(name, 0) + 1
+                self.log('%s: %s' % (instance.pk, ', '.join(names)), 2)
+            pending and update_versions_batch(pending)
+
+            self.log('%s.%s.%s: %s' % (
+                model._meta.app_label, model.__name__, field.name,
+                ', '.join('%s - %s' % i for i in sorted(counts.items()))
+                or 'nothing to regenerate',), 1)
+
+    def log(self, message, verbosity=1):
+        self.verbosity >= verbosity and self.stdout.write(message)
@@ -0,0 +1,90 @@
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from diverse import settings
+from diverse.cache import ModelCache
+from diverse.management.utils import get_diverse_fields, iterate_instances
+
+
+class Command(BaseCommand):
+    help = ('Fill "<field>_cache" values of diverse fields for existing'
+            ' version files (versions are not generated, dimensions are'
+            ' read from image headers only).')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'labels', nargs='*', metavar='app_label[.Model[.field]]',
+            help='Diverse fields to process (all by default).')
+        parser.add_argument(
+            '--workers', type=int, default=settings.WORKERS,
+            help='Count of threads, which read version files data.')
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Count of rows fetched and updated (bulk_update) at once.')
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Recompute already cached values too.')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        self.force = options['force']
+
+        for model, field in get_diverse_fields(options['labels']):
+            cachefield = '%s_cache' % field.name
+            label = '%s.%s.%s' % (model._meta.app_label,
+                                  model.__name__, field.name)
+            if cachefield not in [i.name for i in model._meta.fields]:
+                self.log('Skip %s: there is no "%s" field.'
+                         % (label, cachefield), 2)
+                continue
+
+            count = self.warm(model, field, cachefield,
+                              options['batch_size'], options['workers'])
+            self.log('Updated %s: %s rows.' % (label, count), 1)
+
+    def log(self, message, verbosity=1):
+        self.verbosity >= verbosity and self.stdout.write(message)
+
+    def warm(self, model, field, cachefield, batch_size, workers):
+        instances = iterate_instances(model, field, batch_size,
+                                      only=[cachefield])
+        count, batch = 0, []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for instance in instances:
+                batch.append(instance)
+                if len(batch) >= batch_size:
+                    count += self.update(model, field, cachefield,
+                                         batch, executor)
+                    batch = []
+            if batch:
+                count += self.update(model, field, cachefield,
+                                     batch, executor)
+        return count
+
+    def update(self, model, field, cachefield, instances, executor):
+        results = executor.map(partial(self.compute, field), instances)
+        changed = [i for i, j in zip(instances, results) if j]
+        changed and model._default_manager.bulk_update(
+            changed, [cachefield], batch_size=len(changed))
+        return len(changed)
+
+    def compute(self, field, instance):
+        """set cache values of existing versions, return True if changed"""
+        file = getattr(instance, field.attname)
+        items = {}
+        for name in file._container._versions.keys():
+            version = getattr(file._container, name)
+            # cache is used only by not lazy versions with model cache
+            if (version.ac_lazy or not version.ac_cache or
+                    not issubclass(version.ac_cache, ModelCache)):
+                continue
+            if not self.force and version.cache_get():
+                continue
+            if not version.storage().exists(version.name):
+                continue
+            items.setdefault(version.ac_cache, []).append(
+                (version, version.cache_values(),))
+
+        for cache, values in items.items():
+            cache().set_many(values, commit=False)
+        return bool(items)
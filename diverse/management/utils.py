@@ -0,0 +1,47 @@
+from django.apps import apps
+from django.core.management.base import CommandError
+
+
+def get_diverse_fields(labels=None):
+    """
+    get list of (model, field) pairs of diverse fields by labels
+    (app_label, app_label.Model or app_label.Model.field) or all of them
+    """
+
+    # import here to avoid app registry access while module loading
+    from ..fields.fields import DiverseFileField
+
+    result = []
+    for model in apps.get_models():
+        for field in model._meta.concrete_fields:
+            if not isinstance(field, DiverseFileField):
+                continue
+            names = (model._meta.app_label,
+                     '%s.%s' % (model._meta.app_label, model.__name__),
+                     '%s.%s.%s' % (model._meta.app_label, model.__name__,
+                                   field.name),)
+            if not labels or any(i in names for i in labels):
+                result.append((model, field,))
+
+    if labels and not result:
+        raise CommandError('Diverse fields not found by labels: %s.'
+                           % ', '.join(labels))
+    return result
+
+
+def iterate_instances(model, field, chunk_size=1000, only=None,
+                      after_pk=None):
+    """
+    stream instances with not empty field value, load only required columns
+    if container is not instance specific (get_container_for_<field>),
+    after_pk - start after this primary key value (resume processing)
+    """
+
+    queryset = (model._default_manager.exclude(**{field.attname: ''})
+                                      .exclude(**{field.attname: None})
+                                      .order_by('pk'))
+    if after_pk is not None:
+        queryset = queryset.filter(pk__gt=after_pk)
+    if not hasattr(model, 'get_container_for_%s' % field.name):
+        queryset = queryset.only('pk', field.attname, *(only or []))
+    return queryset.iterator(chunk_size=chunk_size)
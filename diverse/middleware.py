@@ -0,0 +1,17 @@
+from . import writebehind
+
+
+class WriteBehindMiddleware(object):
+    """
+    flush buffered cache updates of request thread at request end
+    (DIVERSE_WRITE_BEHIND)
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            writebehind.buffer.flush(current=True)
@@ -1,4 +1,6 @@
 class BaseProcessor(object):
+    # time limit of processor call in seconds (see TempFileConveyor)
+    time_limit = None
 
     def run(self, name, mimetype, storage, filever):
         # (filename (as status), mimetype,) tuple expected
@@ -7,6 +9,14 @@ class BaseProcessor(object):
     def process(self, name, mimetype, storage, filever):
         raise NotImplementedError
 
+    def prepare_batch(self, filevers):
+        """
+        prepare processing of same version of several source files at once
+        (processor is the first one of version), result is kept by each
+        file version until its processing (see ImageKit), default - nothing
+        """
+        pass
+
     def extension(self, filever):
         """
         suggested extension:
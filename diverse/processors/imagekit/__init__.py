@@ -2,3 +2,4 @@
 # based on pilkit processors (installed as dependency)
 from pilkit import processors as ikp
 from .processor import ImageKit
+from .processors import AutoOrient
@@ -0,0 +1,225 @@
+"""
+Processors pipeline optimizer (see ImageKit optimize option).
+
+Pipeline is rewritten for known image size before execution:
+- consecutive geometric pilkit processors (Resize, ResizeToFit without
+  mat_color, ResizeToCover, ResizeToFill, Crop) are fused into one
+  resample of source region (FusedResize), no-op ones are dropped;
+- with reordering only: pointwise adjustments (see is_pointwise) do not
+  split geometric processors, they go to the side of fused resample with
+  less pixels (after downscaling, before upscaling).
+Sizes are computed exactly as pilkit does, pixels differ by resampling
+rounding only, use verify function to check it for real images.
+"""
+from PIL import ImageChops, ImageStat
+from pilkit import processors as ikp
+from pilkit.processors.utils import resolve_palette
+
+
+class FusedResize(object):
+    """
+    One resample of source box (left, top, right, bottom floats) to size,
+    result of fused geometric processors (cropped - result of pilkit crop
+    is RGBA image, mode is converted for equivalence)
+    """
+
+    LANCZOS = ikp.Resize.LANCZOS
+
+    def __init__(self, size, box, cropped=False):
+        self.size, self.box, self.cropped = size, box, cropped
+
+    def process(self, img):
+        box = tuple(self.box)
+        if self.size == img.size and box == (0, 0,) + img.size:
+            pass
+        elif all(float(i).is_integer() for i in box) and self.size == (
+                int(box[2] - box[0]), int(box[3] - box[1]),):
+            img = img.crop(tuple(int(i) for i in box))
+        else:
+            img = resolve_palette(img)
+            img = img.resize(self.size, self.LANCZOS, box=box)
+        return img.convert('RGBA') if self.cropped else img
+
+
+class Geometry(object):
+    """state of fused geometric processors: source box and output size"""
+
+    def __init__(self, size):
+        self.source = size
+        self.box = (0.0, 0.0, float(size[0]), float(size[1]),)
+        self.size = size
+        self.cropped = False
+
+    def resize(self, width, height, upscale=True):
+        """resize output, return False if it is not fusable"""
+        # pilkit Resize: downscale only if both sides are greater
+        if not upscale and not (width < self.size[0] and
+                                height < self.size[1]):
+            return True
+        # upscaling of downscaled output is not fusable (details are lost
+        # by downscaling, resample of source keeps them)
+        if (width > self.size[0] or height > self.size[1]) and (
+                self.size[0] < self.box[2] - self.box[0] or
+                self.size[1] < self.box[3] - self.box[1]):
+            return False
+        self.size = (width, height,)
+        return True
+
+    def crop(self, width, height, x, y):
+        # region of current output (pilkit pastes image at x, y)
+        left, top = -x, -y
+        if left < 0 or top < 0 or (left + width > self.size[0] or
+                                   top + height > self.size[1]):
+            return False
+        scale_x = (self.box[2] - self.box[0]) / self.size[0]
+        scale_y = (self.box[3] - self.box[1]) / self.size[1]
+        self.box = (self.box[0] + left * scale_x,
+                    self.box[1] + top * scale_y,
+                    self.box[0] + (left + width) * scale_x,
+                    self.box[1] + (top + height) * scale_y,)
+        self.size, self.cropped = (width, height,), True
+        return True
+
+    def state(self):
+        return (self.box, self.size, self.cropped,)
+
+    def restore(self, state):
+        self.box, self.size, self.cropped = state
+
+    def apply(self, proc):
+        """apply geometric processor, return False if it is not fusable"""
+        cls, width, height = type(proc), self.size[0], self.size[1]
+        if cls is ikp.Resize:
+            return self.resize(proc.width, proc.height, proc.upscale)
+        elif cls is ikp.ResizeToFit and proc.mat_color is None:
+            if proc.width is not None and proc.height is not None:
+                ratio = min(float(proc.width) / width,
+                            float(proc.height) / height)
+            elif proc.width is None and proc.height is None:
+                return False
+            else:
+                ratio = (float(proc.height) / height if proc.width is None
+                         else float(proc.width) / width)
+            return self.resize(int(round(width * ratio)),
+                               int(round(height * ratio)), proc.upscale)
+        elif cls in (ikp.ResizeToCover, ikp.ResizeToFill,):
+            if proc.width is None or proc.height is None:
+                return False
+            ratio = max(float(proc.width) / width,
+                        float(proc.height) / height)
+            if not self.resize(int(round(width * ratio)),
+                               int(round(height * ratio)), proc.upscale):
+                return False
+            if cls is ikp.ResizeToFill:
+                return self.apply(ikp.Crop(proc.width, proc.height,
+                                           anchor=proc.anchor))
+            return True
+        elif cls is ikp.Crop:
+            if proc.width is None or proc.height is None:
+                return False
+            width, height = (min(width, proc.width),
+                             min(height, proc.height),)
+            if proc.x is not None or proc.y is not None:
+                x, y = proc.x or 0, proc.y or 0
+            else:
+                anchor = ikp.Anchor.get_tuple(proc.anchor or
+                                              ikp.Anchor.CENTER)
+                x = int(float(width - self.size[0]) * float(anchor[0]))
+                y = int(float(height - self.size[1]) * float(anchor[1]))
+            return self.crop(width, height, x, y)
+        return False
+
+    def processor(self):
+        """get FusedResize or None if geometry is not changed"""
+        if self.size == self.source and not self.cropped:
+            return None
+        return FusedResize(self.size, self.box, cropped=self.cropped)
+
+
+def is_geometric(proc):
+    return type(proc) in (ikp.Resize, ikp.ResizeToFit, ikp.ResizeToCover,
+                          ikp.ResizeToFill, ikp.Crop,)
+
+
+def is_pointwise(proc):
+    # adjustments with factors in 0..1 are blends of image with black, gray
+    # or mean image (values are not clamped), so they commute with linear
+    # resampling, contrast blends with mean, which is changed by cropping
+    # (sharpness is not pointwise, greater factors are clamped)
+    return (type(proc) is ikp.Adjust and proc.sharpness == 1.0 and
+            all(0.0 <= i <= 1.0 for i in (proc.color, proc.brightness,
+                                          proc.contrast,)))
+
+
+def optimize(processors, size, reorder=False):
+    """
+    get optimized processors list for image of size (width, height),
+    reorder - move pointwise processors to cheaper side of fused ones
+    """
+
+    result, processors, index = [], list(processors), 0
+    while index < len(processors):
+        # collect run of fusable geometric (and pointwise) processors
+        geometry, pointwise, start = size and Geometry(size), [], index
+        while geometry and index < len(processors):
+            proc = processors[index]
+            if reorder and is_pointwise(proc):
+                if proc.contrast != 1.0 and geometry.cropped:
+                    break
+                pointwise.append(proc)
+            elif is_geometric(proc):
+                state = geometry.state()
+                if not geometry.apply(proc) or geometry.cropped and any(
+                        i.contrast != 1.0 for i in pointwise):
+                    geometry.restore(state)
+                    break
+            else:
+                break
+            index += 1
+
+        if index == start:
+            # size is unknown after not fusable processor (except adjust)
+            proc = processors[index]
+            result.append(proc)
+            size = size if isinstance(proc, ikp.Adjust) else None
+            index += 1
+            continue
+
+        fused = geometry.processor()
+        fused = [fused] if fused else []
+        if geometry.size[0] * geometry.size[1] < size[0] * size[1]:
+            result.extend(fused + pointwise)
+        else:
+            result.extend(pointwise + fused)
+        size = geometry.size
+    return result
+
+
+def difference(one, two):
+    """
+    max mean absolute difference of channels of two images (0..255) or
+    None if sizes differ
+    """
+
+    if one.size != two.size:
+        return None
+    mode = 'RGBA' if 'A' in one.mode + two.mode else 'RGB'
+    diff = ImageChops.difference(one.convert(mode), two.convert(mode))
+    return max(ImageStat.Stat(diff).mean)
+
+
+def verify(processors, img, tolerance=1.0, reorder=False):
+    """
+    process image by original and optimized processors, return (result,
+    difference), result is True if images are equal within tolerance
+    """
+
+    img.load()
+    original, optimized = img, img
+    for proc in processors:
+        original = proc.process(original)
+    for proc in optimize(processors, img.size, reorder=reorder):
+        optimized = proc.process(optimized)
+    value = difference(original, optimized)
+    return (value is not None and original.mode == optimized.mode and
+            value <= tolerance), value
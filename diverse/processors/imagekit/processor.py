@@ -2,9 +2,17 @@ import os
 from pilkit.lib import StringIO
 from pilkit.exceptions import UnknownExtension, UnknownFormat
 from pilkit.utils import (format_to_extension, extension_to_format,
-                          img_to_fobj, open_image)
+                          img_to_fobj, open_image, prepare_image)
+from diverse import profiling
 from diverse.processor import BaseProcessor
 from .utils import IKContentFile
+from .optimizer import optimize
+
+
+def is_batch_processor(processor):
+    """check processor is numpy one (see diverse.processors.numpy)"""
+    return (hasattr(processor, 'process_batch') or
+            hasattr(processor, 'analyze_batch'))
 
 
 class ProcessorPipeline(list):
@@ -19,21 +27,76 @@ class ProcessorPipeline(list):
           with "takes_file_verion" attribute support.
     """
     def process(self, img, filever):
-        for proc in self:
+        for index, proc in enumerate(self):
             tfv = getattr(proc, 'takes_file_verion', False)
-            img = proc.process(*((img, filever,) if tfv else (img,)))
+            with profiling.stage('%s.%s' % (index, proc.__class__.__name__,)):
+                img = proc.process(*((img, filever,) if tfv else (img,)))
         return img
 
 
+class OptimizedProcessorPipeline(ProcessorPipeline):
+    """
+    Processors pipeline, which is rewritten for image size before
+    execution (see diverse.processors.imagekit.optimizer).
+    """
+    reorder = False
+
+    def process(self, img, filever):
+        processors = optimize(self, img.size, reorder=self.reorder)
+        return ProcessorPipeline(processors).process(img, filever)
+
+
+class ReorderedProcessorPipeline(OptimizedProcessorPipeline):
+    """Optimized pipeline with pointwise processors reordering."""
+    reorder = True
+
+
 class ImageKit(BaseProcessor):
     processor_pipeline_class = ProcessorPipeline
 
+    # formats with "quality" option, which is searched by bytes budget
+    quality_formats = ('JPEG', 'WEBP',)
+    # options added after fingerprints of ImageKit specs are stored (they
+    # are fingerprinted only with not default values, see spec_data)
+    spec_defaults = {'max_bytes': None, 'target_bytes': None,
+                     'min_quality': 30, 'max_iterations': 8,}
+
     def __init__(self, processors=None, format=None,
-                        options=None, autoconvert=True):
+                        options=None, autoconvert=True,
+                        max_bytes=None, target_bytes=None,
+                        min_quality=30, max_iterations=8,
+                        optimize=False):
+        """
+        processors     - pilkit processors list (or callable)
+        format         - output format (PIL name), guessed if empty
+        options        - PIL save options (quality is max quality value
+                         if bytes budget is set)
+        autoconvert    - prepare image for format (pilkit prepare_image)
+        max_bytes      - bytes budget: highest quality, which output fits
+                         into value (smallest output if nothing fits)
+        target_bytes   - bytes budget: quality, which output size is the
+                         closest to value (max_bytes is used if both set)
+        min_quality    - lowest searched quality value
+        max_iterations - max count of encodings while searching
+        optimize       - fuse geometric processors into one resample,
+                         "reorder" value - move pointwise adjustments
+                         after downscaling too (output may differ by
+                         resampling rounding, see optimizer)
+        """
+
         self.processors = processors
         self.format = format
         self.options = options or {}
         self.autoconvert = autoconvert
+        self.max_bytes = max_bytes
+        self.target_bytes = target_bytes
+        self.min_quality = min_quality
+        self.max_iterations = max_iterations
+        if optimize:
+            # instance attr: spec fingerprint is changed only if enabled
+            self.processor_pipeline_class = (
+                ReorderedProcessorPipeline if optimize == 'reorder' else
+                OptimizedProcessorPipeline)
 
     def extension(self, filever):
         if self.format:
@@ -51,21 +114,23 @@ class ImageKit(BaseProcessor):
         filename, mimetype = False, mimetype
 
         # exception will be processed in versionfile generate method
-        try:
-            fp = storage.open(name)
-        except IOError:
-            raise
+        with profiling.stage('read'):
+            try:
+                fp = storage.open(name)
+            except IOError:
+                raise
 
-        # get content and close processing file
-        content = StringIO(fp.read())
-        fp.close()
+            # get content and close processing file
+            content = StringIO(fp.read())
+            fp.close()
 
         # main transformation call
         content = self._process_content(name, content, filever)
 
         # save processing file (delete original and save new with same name)
-        storage.delete(name)
-        filename = storage.save(name, content)
+        with profiling.stage('write'):
+            storage.delete(name)
+            filename = storage.save(name, content)
 
         # result filename (as status) and mimetype for next proc
         return filename, content.file.content_type
@@ -79,16 +144,21 @@ class ImageKit(BaseProcessor):
         #   - img_to_fobj now receive also autoconvert param
         #   - return only content value, not img as first
 
-        source_file = filever.source_file
-        img = open_image(content)
-        original_format = img.format
+        processors = self._processors(filever)
+        prepared = filever.__dict__.pop('_prepared', None)
+        if prepared and prepared[0] is self:
+            # leading processors are processed already (see prepare_batch)
+            processor, img, original_format, meta, processors = prepared
+            filever.generation_meta.update(meta)
+        else:
+            with profiling.stage('decode'):
+                img = open_image(content)
+                # pil decodes lazily, force it to measure decoding separately
+                profiling.active() and img.load()
+            original_format = img.format
 
         # run the processors
-        processors = self.processors
-        if callable(processors):
-            processors = processors(source_file, self.mimetype)
-        img = self.processor_pipeline_class(processors or
-                                            []).process(img, filever)
+        img = self.processor_pipeline_class(processors).process(img, filever)
         options = dict(self.options or {})
 
         # Determine the format.
@@ -102,8 +172,144 @@ class ImageKit(BaseProcessor):
                 pass
         format = format or img.format or original_format or 'JPEG'
 
-        imgfile = img_to_fobj(img, format,
-                              autoconvert=self.autoconvert, **options)
-        content = IKContentFile(filename, imgfile.read(), format=format)
+        with profiling.stage('encode'):
+            if (self.max_bytes or self.target_bytes) and (
+                    format.upper() in self.quality_formats):
+                data, options = self._encode_budget(img, format, options)
+                filever.generation_meta['encoding'] = options
+            else:
+                data = img_to_fobj(img, format, autoconvert=self.autoconvert,
+                                   **options).read()
+            content = IKContentFile(filename, data, format=format)
 
         return content
+
+    def _processors(self, filever):
+        processors = self.processors
+        if callable(processors):
+            processors = processors(filever.source_file, self.mimetype)
+        return list(processors or [])
+
+    def prepare_batch(self, filevers):
+        """
+        run processors of same version of several source files up to the
+        end of first sequence of numpy processors, which process same-size
+        images at once (see diverse.processors.numpy.process_batch), process
+        of each version continues with result, versions which fail here are
+        processed as usual
+        """
+
+        groups = {}
+        for filever in filevers:
+            processors = self._processors(filever)
+            start = next((i for i, j in enumerate(processors)
+                          if is_batch_processor(j)), None)
+            if start is None:
+                continue
+            end = start
+            while end < len(processors) and is_batch_processor(
+                    processors[end]):
+                end += 1
+            try:
+                with filever.process_source() as source:
+                    img = open_image(StringIO(source.read()))
+                original_format = img.format
+                # generation metadata of leading processors is kept
+                meta, filever.generation_meta = filever.generation_meta, {}
+                try:
+                    img = self.processor_pipeline_class(
+                        processors[:start]).process(img, filever)
+                finally:
+                    meta, filever.generation_meta = (filever.generation_meta,
+                                                     meta)
+            except Exception:
+                continue
+            key = tuple(id(i) for i in processors[start:end])
+            groups.setdefault(key, []).append((
+                filever, img, original_format, meta, processors[start:end],
+                processors[end:],))
+
+        if not groups:
+            return
+        from diverse.processors.numpy import process_batch
+        for items in groups.values():
+            features = [{} for i in items]
+            try:
+                images = process_batch(items[0][4], [i[1] for i in items],
+                                       features)
+            except Exception:
+                continue
+            for item, img, values in zip(items, images, features):
+                filever, meta = item[0], item[3]
+                values and meta.setdefault('features', {}).update(values)
+                filever._prepared = (self, img, item[2], meta, item[5],)
+
+    def _encode_budget(self, img, format, options):
+        """
+        encode image within bytes budget: binary search of quality (with
+        progressive mode and chroma subsampling toggling for JPEG), return
+        (data, chosen options with "bytes" and "iterations" values)
+        """
+
+        jpeg = format.upper() == 'JPEG'
+        if self.autoconvert:
+            img, save_kwargs = prepare_image(img, format)
+            options = dict(save_kwargs, **options)
+        if jpeg:
+            options.setdefault('optimize', True)
+        budget = self.max_bytes or self.target_bytes
+        high = int(options.pop('quality', 95))
+        low = min(int(self.min_quality), high)
+        iterations = [0]
+
+        def encode(quality, **extra):
+            iterations[0] += 1
+            opts = dict(options, quality=quality, **extra)
+            data = img_to_fobj(img, format, autoconvert=False, **opts).read()
+            return data, opts
+
+        def better(one, two):
+            size1, size2 = len(one[0]), len(two[0])
+            if not self.max_bytes:
+                # target: the closest size
+                return (one if abs(size1 - budget) <= abs(size2 - budget)
+                        else two)
+            fits1, fits2 = size1 <= budget, size2 <= budget
+            if fits1 != fits2:
+                return one if fits1 else two
+            if fits1:
+                # max: the highest quality of fitting ones
+                return (one if one[1]['quality'] >= two[1]['quality']
+                        else two)
+            return one if size1 <= size2 else two
+
+        # choose smaller variant of progressive mode at max quality
+        best = encode(high)
+        if jpeg and 'progressive' not in options:
+            variant = encode(high, progressive=True)
+            if len(variant[0]) < len(best[0]):
+                best, options = variant, dict(options, progressive=True)
+
+        # binary search of quality (size grows with quality), high value
+        # is exclusive bound (its output does not fit)
+        if len(best[0]) > budget:
+            while low < high and iterations[0] < self.max_iterations:
+                quality = (low + high) // 2
+                result = encode(quality)
+                best = better(best, result)
+                if len(result[0]) > budget:
+                    high = quality
+                else:
+                    low = quality + 1
+
+        # stronger chroma subsampling (4:2:0) as last resort
+        if (len(best[0]) > budget and jpeg and
+                options.get('subsampling', 2) != 2 and
+                iterations[0] < self.max_iterations):
+            best = better(best, encode(best[1]['quality'], subsampling=2))
+
+        data, options = best
+        options = dict((i, j,) for i, j in options.items()
+                       if isinstance(j, (int, float, bool, str,)))
+        options.update(bytes=len(data), iterations=iterations[0])
+        return data, options
@@ -0,0 +1,53 @@
+from PIL import Image
+from pilkit import processors as ikp
+
+
+# transpose methods for EXIF orientation values (as pilkit Transpose does)
+EXIF_ORIENTATION_STEPS = {
+    1: [],
+    2: [Image.FLIP_LEFT_RIGHT],
+    3: [Image.ROTATE_180],
+    4: [Image.FLIP_TOP_BOTTOM],
+    5: [Image.ROTATE_270, Image.FLIP_LEFT_RIGHT],
+    6: [Image.ROTATE_270],
+    7: [Image.ROTATE_90, Image.FLIP_LEFT_RIGHT],
+    8: [Image.ROTATE_90],
+}
+
+
+class AutoOrient(object):
+    """
+    Transpose image by EXIF orientation of source file, which is taken
+    from source metadata (extracted once at file saving, see
+    BaseContainer.source_meta) instead of reading EXIF of each image.
+    Parent version image of derived version is oriented already if parent
+    has AutoOrient (or Transpose(Transpose.AUTO)) processor too.
+    """
+
+    takes_file_verion = True
+
+    def process(self, img, filever):
+        parent = filever.parent()
+        if parent and self.oriented(parent):
+            return img
+        meta = filever.source_meta()
+        if not meta:
+            # unknown metadata: read exif from image itself
+            return ikp.Transpose(ikp.Transpose.AUTO).process(img)
+        for method in EXIF_ORIENTATION_STEPS.get(
+                meta.get('orientation', None) or 1, []):
+            img = img.transpose(method)
+        return img
+
+    @classmethod
+    def oriented(cls, filever):
+        """check that version file processors orient image"""
+        for proc in filever.processors():
+            processors = getattr(proc, 'processors', None)
+            if not isinstance(processors, (list, tuple,)):
+                continue
+            if any(isinstance(i, cls) or (
+                    isinstance(i, ikp.Transpose) and
+                    ikp.Transpose.AUTO in i.methods) for i in processors):
+                return True
+        return filever.parent() and cls.oriented(filever.parent())
@@ -0,0 +1,4 @@
+# numpy vectorized processors (optional "numpy" dependency)
+from .processors import (ArrayProcessor, ArrayPipeline, ColorAdjust,
+                         AutoLevels, Sharpen, FlattenAlpha, ArrayAnalyzer,
+                         PerceptualHash, DominantColor, process_batch)
@@ -0,0 +1,286 @@
+import numpy as np
+from PIL import Image
+
+
+# conversion between PIL images and float arrays (height, width, channels)
+def to_array(img):
+    """get float32 array with values in 0..255 range of L, RGB or RGBA image"""
+    if img.mode not in ('L', 'RGB', 'RGBA',):
+        img = img.convert('RGBA' if 'A' in img.mode or 'transparency' in
+                          img.info else 'RGB')
+    array = np.asarray(img, dtype=np.float32)
+    return array[:, :, None] if array.ndim == 2 else array
+
+
+def from_array(array):
+    """get image by float array (mode by channels count: L, RGB or RGBA)"""
+    array = np.clip(np.rint(array), 0, 255).astype(np.uint8)
+    mode = {1: 'L', 3: 'RGB', 4: 'RGBA'}[array.shape[2]]
+    return Image.fromarray(array[:, :, 0] if mode == 'L' else array, mode)
+
+
+def luma(batch):
+    """luma (ITU-R 601) of batch (n, height, width, channels) of arrays"""
+    if batch.shape[3] < 3:
+        return batch[..., 0]
+    return (batch[..., 0] * 0.299 + batch[..., 1] * 0.587 +
+            batch[..., 2] * 0.114)
+
+
+def stack(images):
+    """
+    group images by size and mode, return list of (indexes, batch) pairs,
+    batch is array (n, height, width, channels) of same-size images
+    """
+
+    groups = {}
+    for index, img in enumerate(images):
+        array = to_array(img)
+        groups.setdefault(array.shape, []).append((index, array,))
+    return [([i for i, j in items], np.stack([j for i, j in items]),)
+            for items in groups.values()]
+
+
+def process_batch(processors, images, features=None):
+    """
+    process list of images with array processors and analyzers, same-size
+    images are processed by one vectorized call of each one (result equals
+    result of processing one by one), return list of processed images in
+    order of source ones, analyzers results are set into features list
+    items (dict of each image) if it is passed
+    """
+
+    result = [None] * len(images)
+    for indexes, batch in stack(images):
+        # images are not converted by analyzers only
+        processed = False
+        for processor in processors:
+            if isinstance(processor, ArrayAnalyzer):
+                values = (processor.analyze_batch(batch)
+                          if features is not None else ())
+                for index, value in zip(indexes, values):
+                    features[index][processor.key] = value
+                continue
+            # values are rounded as by image conversion between processors
+            batch = np.clip(np.rint(processor.process_batch(batch)), 0, 255)
+            processed = True
+        for index, array in zip(indexes, batch):
+            result[index] = from_array(array) if processed else images[index]
+    return result
+
+
+# processors
+class ArrayProcessor(object):
+    """
+    Base class of numpy processors, compatible with pilkit processors
+    (process method with image argument), so it may be used in ImageKit
+    processors list, process_batch receives array (n, height, width,
+    channels) of same-size images with values in 0..255 range (see
+    process_batch function and ImageKit prepare_batch).
+    Alpha channel is not changed by color processors (color_only).
+    """
+
+    color_only = True
+
+    def process(self, img):
+        return from_array(self.process_batch(to_array(img)[None])[0])
+
+    def process_batch(self, batch):
+        if self.color_only and batch.shape[3] in (2, 4,):
+            color = self.process_color(batch[..., :-1])
+            return np.concatenate([color, batch[..., -1:]], axis=3)
+        return self.process_color(batch)
+
+    def process_color(self, batch):
+        raise NotImplementedError
+
+
+class ArrayPipeline(ArrayProcessor):
+    """
+    Run array processors with one image to array conversion (instead of
+    conversion in each processor), may be used in ImageKit processors list.
+    """
+
+    color_only = False
+
+    def __init__(self, processors):
+        self.processors = processors
+
+    def process_batch(self, batch):
+        for processor in self.processors:
+            batch = processor.process_batch(batch)
+        return batch
+
+
+class ColorAdjust(ArrayProcessor):
+    """
+    Brightness, contrast, saturation (1.0 - unchanged values) and gamma
+    correction, contrast is scaled around mean luma of each image.
+    """
+
+    def __init__(self, brightness=1.0, contrast=1.0, saturation=1.0,
+                 gamma=1.0):
+        self.brightness, self.contrast = brightness, contrast
+        self.saturation, self.gamma = saturation, gamma
+
+    def process_color(self, batch):
+        batch = batch * self.brightness if self.brightness != 1.0 else batch
+        if self.contrast != 1.0:
+            mean = luma(batch).mean(axis=(1, 2,))[:, None, None, None]
+            batch = mean + (batch - mean) * self.contrast
+        if self.saturation != 1.0 and batch.shape[3] >= 3:
+            gray = luma(batch)[..., None]
+            batch = gray + (batch - gray) * self.saturation
+        if self.gamma != 1.0:
+            batch = 255.0 * (np.clip(batch, 0, 255) / 255.0) ** (
+                1.0 / self.gamma)
+        return batch
+
+
+class AutoLevels(ArrayProcessor):
+    """
+    Stretch each channel of each image to full range, cutoff - percent of
+    darkest and lightest pixels ignored while range detection.
+    """
+
+    def __init__(self, cutoff=0.5):
+        self.cutoff = cutoff
+
+    def process_color(self, batch):
+        low, high = np.percentile(batch, [self.cutoff, 100 - self.cutoff],
+                                  axis=(1, 2,), keepdims=True)
+        scale = 255.0 / np.maximum(high - low, 1.0)
+        return (batch - low) * scale
+
+
+class Sharpen(ArrayProcessor):
+    """Unsharp mask with box blur of (2 * radius + 1) size."""
+
+    def __init__(self, amount=1.0, radius=1):
+        self.amount, self.radius = amount, radius
+
+    def blur(self, batch):
+        # separable box filter by cumulative sums (edges are replicated)
+        size = 2 * self.radius + 1
+        for axis in (1, 2,):
+            pad = [(0, 0,)] * 4
+            pad[axis] = (self.radius + 1, self.radius,)
+            summed = np.cumsum(np.pad(batch, pad, mode='edge'), axis=axis)
+            upper = np.take(summed, np.arange(size, summed.shape[axis]),
+                            axis=axis)
+            lower = np.take(summed, np.arange(0, summed.shape[axis] - size),
+                            axis=axis)
+            batch = (upper - lower) / size
+        return batch
+
+    def process_color(self, batch):
+        return batch + self.amount * (batch - self.blur(batch))
+
+
+class FlattenAlpha(ArrayProcessor):
+    """Composite image with alpha onto solid background color."""
+
+    color_only = False
+
+    def __init__(self, background=(255, 255, 255,)):
+        self.background = background
+
+    def process_batch(self, batch):
+        if batch.shape[3] not in (2, 4,):
+            return batch
+        color, alpha = batch[..., :-1], batch[..., -1:] / 255.0
+        background = np.asarray(self.background[:color.shape[3]],
+                                dtype=np.float32)
+        return color * alpha + background * (1.0 - alpha)
+
+
+# analyzers: image is not changed, result is stored in version metadata
+class ArrayAnalyzer(object):
+    """
+    Base class of numpy analyzers, result of each image is stored in
+    "features" generation metadata of version file (see accessor
+    attrs_meta) by key, analyze_batch returns list of results for array
+    of same-size images (n, height, width, channels).
+    """
+
+    takes_file_verion = True
+    key = None
+
+    def process(self, img, filever=None):
+        if filever is not None:
+            features = filever.generation_meta.setdefault('features', {})
+            features[self.key] = self.analyze_batch(to_array(img)[None])[0]
+        return img
+
+    def analyze(self, images):
+        """analyze list of images (same-size ones at once)"""
+        result = [None] * len(images)
+        for indexes, batch in stack(images):
+            for index, value in zip(indexes, self.analyze_batch(batch)):
+                result[index] = value
+        return result
+
+    def analyze_batch(self, batch):
+        raise NotImplementedError
+
+
+class PerceptualHash(ArrayAnalyzer):
+    """DCT based perceptual hash (hex string of size * size bits)."""
+
+    key = 'phash'
+
+    def __init__(self, size=8, scale=4):
+        self.size, self.scale = size, scale
+
+    def analyze_batch(self, batch):
+        side = self.size * self.scale
+        # downscale luma by PIL (per image), dct is vectorized
+        gray = np.stack([
+            np.asarray(Image.fromarray(np.clip(i, 0, 255).astype(np.uint8))
+                       .resize((side, side,), Image.BILINEAR),
+                       dtype=np.float32)
+            for i in luma(batch)])
+        index = np.arange(side)
+        dct = np.cos(np.pi * (2 * index[None, :] + 1) * index[:, None] /
+                     (2.0 * side))
+        coefs = dct @ gray @ dct.T
+        coefs = coefs[:, :self.size, :self.size].reshape(len(batch), -1)
+        median = np.median(coefs[:, 1:], axis=1, keepdims=True)
+        bits = coefs > median
+        width = (self.size * self.size + 3) // 4
+        return ['%0*x' % (width, int(''.join('1' if j else '0' for j in i),
+                                     2)) for i in bits]
+
+
+class DominantColor(ArrayAnalyzer):
+    """
+    The most frequent color (hex string) by histogram of colors quantized
+    to bits per channel, color is averaged inside of the histogram bin.
+    """
+
+    key = 'dominant_color'
+
+    def __init__(self, bits=4):
+        self.bits = bits
+
+    def analyze_batch(self, batch):
+        if batch.shape[3] in (2, 4,):
+            batch = FlattenAlpha().process_batch(batch)
+        if batch.shape[3] == 1:
+            batch = np.repeat(batch, 3, axis=3)
+        count, bins = len(batch), 2 ** (3 * self.bits)
+        pixels = batch.reshape(count, -1, 3)
+        quantized = np.clip(pixels, 0, 255).astype(np.int64) >> (
+            8 - self.bits)
+        index = ((quantized[..., 0] << (2 * self.bits)) |
+                 (quantized[..., 1] << self.bits) | quantized[..., 2])
+        # one bincount call for all images (bins are shifted per image)
+        index = index + (np.arange(count) * bins)[:, None]
+        totals = np.bincount(index.ravel(), minlength=count * bins)
+        best = totals.reshape(count, bins).argmax(axis=1)
+        result = []
+        for number, bin in enumerate(best):
+            mask = index[number] == number * bins + bin
+            color = np.rint(pixels[number][mask].mean(axis=0)).astype(int)
+            result.append('#%02x%02x%02x' % tuple(color))
+        return result
@@ -0,0 +1,130 @@
+import time
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from django.core.files.base import File
+
+
+_local = threading.local()
+
+# thread_time is available since python 3.7, before it process cpu time
+# is measured (stages of concurrent threads are overestimated)
+thread_time = getattr(time, 'thread_time', time.process_time)
+
+
+@contextmanager
+def _noop():
+    yield
+
+
+def active():
+    """get profiler active in current thread or None"""
+    return getattr(_local, 'profiler', None)
+
+
+def stage(name):
+    """
+    measure named stage with active profiler (no-op context without it),
+    stages may be nested, each one is reported by its full path
+    """
+
+    profiler = active()
+    return profiler.stage(name) if profiler else _noop()
+
+
+class StageProfiler(object):
+    """
+    Collect wall time, cpu time (of current thread) and tracemalloc peak
+    of nested stages, usage:
+        with StageProfiler() as profiler:
+            with profiler.stage('decode'):
+                ...
+        profiler.results() -> [{'stage': 'decode', 'calls': 1, ...}]
+    """
+
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.records = {}
+        self._stack = []
+        self._tracing = False
+
+    def __enter__(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+        _local.profiler = self
+        return self
+
+    def __exit__(self, *args):
+        _local.profiler = None
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+    def _peak_update(self):
+        # peak is reset on each stage enter, so it is propagated to outer
+        # stages before reset (outer stage peak is max of nested ones)
+        if not self.memory or not self._stack:
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        self._stack[-1]['peak'] = max(self._stack[-1]['peak'], peak)
+
+    @contextmanager
+    def stage(self, name):
+        self._peak_update()
+        entry = {'name': name, 'peak': 0, 'base': 0}
+        if self.memory:
+            # reset_peak is available since python 3.9, before it peak is
+            # traced from profiler start (stage peak may be overestimated)
+            getattr(tracemalloc, 'reset_peak', lambda: None)()
+            entry['base'] = tracemalloc.get_traced_memory()[0]
+        self._stack.append(entry)
+        path = '/'.join(i['name'] for i in self._stack)
+        self._record(path)
+        wall, cpu = time.perf_counter(), thread_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = thread_time() - cpu
+            self._peak_update()
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1]['peak'] = max(self._stack[-1]['peak'],
+                                              entry['peak'])
+            self.add(path, wall, cpu, max(0, entry['peak'] - entry['base']))
+
+    def _record(self, path):
+        return self.records.setdefault(path, {
+            'stage': path, 'calls': 0, 'wall': 0.0, 'cpu': 0.0, 'peak': 0,
+        })
+
+    def add(self, path, wall, cpu, peak):
+        record = self._record(path)
+        record['calls'] += 1
+        record['wall'] += wall
+        record['cpu'] += cpu
+        record['peak'] = max(record['peak'], peak)
+
+    def results(self):
+        """list of stages records (in order of first stage start)"""
+        return [dict(i) for i in self.records.values()]
+
+
+class ScratchFile(File):
+    """source file stored in scratch storage (like FieldFile for versions)"""
+
+    def __init__(self, storage, name):
+        super(ScratchFile, self).__init__(None, name)
+        self.storage = storage
+
+    @property
+    def path(self):
+        return self.storage.path(self.name)
+
+    def open(self, mode='rb'):
+        if self.closed:
+            self.file = self.storage.open(self.name, mode)
+        else:
+            self.seek(0)
+        return self
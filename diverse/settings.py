@@ -4,3 +4,24 @@ from django.conf import settings
 QUIET_OPERATION = getattr(settings, 'DIVERSE_QUIET_OPERATION', False)
 TEMPORARY_DIR = getattr(settings,  'DIVERSE_TEMPORARY_DIR',
                         None) or tempfile.gettempdir()
+WORKERS = getattr(settings, 'DIVERSE_WORKERS', 4)
+DELETE_ON_COMMIT = getattr(settings, 'DIVERSE_DELETE_ON_COMMIT', False)
+DELETE_IN_BACKGROUND = getattr(settings, 'DIVERSE_DELETE_IN_BACKGROUND', False)
+ASYNC_WORKERS = getattr(settings, 'DIVERSE_ASYNC_WORKERS', None) or WORKERS
+VERSIONED_URLS = getattr(settings, 'DIVERSE_VERSIONED_URLS', False)
+WRITE_BEHIND = getattr(settings, 'DIVERSE_WRITE_BEHIND', False)
+WRITE_BEHIND_INTERVAL = getattr(settings,
+                                'DIVERSE_WRITE_BEHIND_INTERVAL', 1.0)
+# failed generations (quiet mode) are retried after exponential backoff:
+# base delay (seconds, 0 - do not record failures) and max delay
+FAILURE_BACKOFF = getattr(settings, 'DIVERSE_FAILURE_BACKOFF', 60)
+FAILURE_BACKOFF_MAX = getattr(settings, 'DIVERSE_FAILURE_BACKOFF_MAX', 86400)
+# time limits (seconds) of processors of version and of each processor,
+# processors run in forked process (see diverse.watchdog), without fork
+# limit is soft: it is checked after processor call, call is not bounded
+VERSION_TIME_LIMIT = getattr(settings, 'DIVERSE_VERSION_TIME_LIMIT', None)
+PROCESSOR_TIME_LIMIT = getattr(settings, 'DIVERSE_PROCESSOR_TIME_LIMIT', None)
+# default generation priority of versions: critical, background, ondemand
+DEFAULT_PRIORITY = getattr(settings, 'DIVERSE_DEFAULT_PRIORITY', 'critical')
+BACKGROUND_WORKERS = getattr(settings,
+                             'DIVERSE_BACKGROUND_WORKERS', None) or WORKERS
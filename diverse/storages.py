@@ -0,0 +1,253 @@
+import os
+import mmap
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from urllib.parse import urljoin
+from django.core.files.base import ContentFile
+from django.core.files.storage import Storage
+from django.utils.deconstruct import deconstructible
+from django.utils.encoding import filepath_to_uri
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+@deconstructible
+class PackStorage(Storage):
+    """
+    Storage of small files (thumbnails) appended into large pack files.
+    Files are located by sqlite index (name -> pack, offset, size), read by
+    mmap and served by diverse.views.pack view (with range requests):
+        thumbs = PackStorage(location='/var/media/packs',
+                             base_url='/media/packs/')
+        urlpatterns += [path('media/packs/<path:name>', diverse_views.pack,
+                             {'storage': thumbs})]
+    Deleted (and replaced) files leave dead bytes in packs, which are
+    reclaimed by compact method (see diverse_compact_packs command).
+    location      - directory of index and pack files
+    base_url      - url prefix of pack view
+    max_pack_size - size of pack, after which next pack is started
+    fsync         - sync pack file to disk before index updating
+    """
+
+    index_name = 'index.sqlite3'
+    lock_name = 'index.lock'
+    pack_pattern = '%06d.pack'
+
+    def __init__(self, location, base_url=None, max_pack_size=64 * 2 ** 20,
+                 fsync=False):
+        self.location = os.path.abspath(location)
+        self.base_url = base_url
+        self.max_pack_size = max_pack_size
+        self.fsync = fsync
+        self._local = threading.local()
+        self._lock = threading.RLock()
+        self._maps = {}
+
+    # index and packs
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            os.makedirs(self.location, exist_ok=True)
+            connection = sqlite3.connect(
+                os.path.join(self.location, self.index_name), timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY,'
+                ' pack INTEGER NOT NULL, offset INTEGER NOT NULL,'
+                ' size INTEGER NOT NULL, mtime REAL NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS files_pack'
+                               ' ON files (pack)')
+            self._local.connection = connection
+        return connection
+
+    def entry(self, name):
+        """get (pack, offset, size, mtime) of file or None"""
+        return self.connection.execute(
+            'SELECT pack, offset, size, mtime FROM files WHERE name = ?',
+            (self._clean_name(name),)).fetchone()
+
+    def pack_path(self, pack):
+        return os.path.join(self.location, self.pack_pattern % pack)
+
+    def packs(self):
+        """list of existing packs numbers"""
+        if not os.path.isdir(self.location):
+            return []
+        return sorted(int(i.split('.')[0]) for i in os.listdir(self.location)
+                      if i.endswith('.pack') and i.split('.')[0].isdigit())
+
+    def _writable_pack(self):
+        packs = self.packs()
+        if packs and os.path.getsize(self.pack_path(packs[-1])) < (
+                self.max_pack_size):
+            return packs[-1]
+        return packs[-1] + 1 if packs else 1
+
+    @contextmanager
+    def _write_lock(self):
+        # threads of process and processes (where flock is available)
+        with self._lock:
+            os.makedirs(self.location, exist_ok=True)
+            with open(os.path.join(self.location, self.lock_name), 'a') as fp:
+                fcntl and fcntl.flock(fp, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl and fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def _append(self, chunks):
+        """append data to writable pack, return (pack, offset, size)"""
+        pack = self._writable_pack()
+        with open(self.pack_path(pack), 'ab') as fp:
+            fp.seek(0, os.SEEK_END)
+            offset = fp.tell()
+            for chunk in chunks:
+                fp.write(chunk)
+            size = fp.tell() - offset
+            fp.flush()
+            self.fsync and os.fsync(fp.fileno())
+        return pack, offset, size
+
+    def _read(self, pack, offset, size):
+        """read data by mmap of pack (remapped if pack is grown)"""
+        if not size:
+            return b''
+        with self._lock:
+            mapped = self._maps.get(pack, None)
+            if mapped is None or len(mapped) < offset + size:
+                mapped and mapped.close()
+                with open(self.pack_path(pack), 'rb') as fp:
+                    mapped = self._maps[pack] = mmap.mmap(
+                        fp.fileno(), 0, access=mmap.ACCESS_READ)
+            return mapped[offset:offset + size]
+
+    def read(self, entry, start=0, length=None):
+        """read data (or its range) of file by index entry"""
+        pack, offset, size = entry[:3]
+        length = size - start if length is None else length
+        return self._read(pack, offset + start, max(0, min(length,
+                                                           size - start)))
+
+    def _unmap(self, pack):
+        with self._lock:
+            mapped = self._maps.pop(pack, None)
+            mapped and mapped.close()
+
+    def _clean_name(self, name):
+        return name.replace('\\', '/').lstrip('/')
+
+    # storage api
+    def _open(self, name, mode='rb'):
+        if 'w' in mode or 'a' in mode or '+' in mode:
+            raise ValueError('Pack storage files are read only.')
+        # pack may be removed by compaction between index lookup and read
+        for attempt in range(2):
+            entry = self.entry(name)
+            if entry is None:
+                raise FileNotFoundError('File "%s" does not exist.' % name)
+            try:
+                data = self.read(entry)
+            except FileNotFoundError:
+                self._unmap(entry[0])
+                continue
+            return ContentFile(data, name=name)
+        raise FileNotFoundError('File "%s" does not exist.' % name)
+
+    def _save(self, name, content):
+        name = self._clean_name(name)
+        with self._write_lock():
+            pack, offset, size = self._append(content.chunks())
+            with self.connection as connection:
+                connection.execute(
+                    'INSERT OR REPLACE INTO files (name, pack, offset, size,'
+                    ' mtime) VALUES (?, ?, ?, ?, ?)',
+                    (name, pack, offset, size, time.time()))
+        return name
+
+    def delete(self, name):
+        with self.connection as connection:
+            connection.execute('DELETE FROM files WHERE name = ?',
+                               (self._clean_name(name),))
+
+    def exists(self, name):
+        return self.entry(name) is not None
+
+    def size(self, name):
+        entry = self.entry(name)
+        if entry is None:
+            raise FileNotFoundError('File "%s" does not exist.' % name)
+        return entry[2]
+
+    def get_modified_time(self, name):
+        entry = self.entry(name)
+        if entry is None:
+            raise FileNotFoundError('File "%s" does not exist.' % name)
+        return datetime.fromtimestamp(entry[3], timezone.utc)
+
+    get_created_time = get_modified_time
+
+    def listdir(self, path):
+        path = self._clean_name(path).rstrip('/')
+        prefix = '%s/' % path if path else ''
+        directories, files = set(), []
+        rows = self.connection.execute(
+            'SELECT name FROM files WHERE substr(name, 1, ?) = ?',
+            (len(prefix), prefix))
+        for name, in rows:
+            rest = name[len(prefix):]
+            if '/' in rest:
+                directories.add(rest.split('/', 1)[0])
+            else:
+                files.append(rest)
+        return sorted(directories), sorted(files)
+
+    def url(self, name):
+        if self.base_url is None:
+            raise ValueError('This file is not accessible via a URL.')
+        return urljoin(self.base_url,
+                       filepath_to_uri(self._clean_name(name)))
+
+    # maintenance
+    def usage(self):
+        """get {pack: (size, live bytes)} of all packs"""
+        live = dict(self.connection.execute(
+            'SELECT pack, SUM(size) FROM files GROUP BY pack').fetchall())
+        return dict((i, (os.path.getsize(self.pack_path(i)),
+                         live.get(i, 0) or 0,)) for i in self.packs())
+
+    def compact(self, min_dead_ratio=0.3):
+        """
+        rewrite live files of packs with dead bytes ratio not less than
+        value into writable pack and remove them, return reclaimed bytes
+        """
+
+        reclaimed = 0
+        with self._write_lock():
+            writable = self._writable_pack()
+            for pack, (size, live) in sorted(self.usage().items()):
+                if pack == writable or not size or (
+                        (size - live) / float(size) < min_dead_ratio):
+                    continue
+                entries = self.connection.execute(
+                    'SELECT name, offset, size FROM files WHERE pack = ?'
+                    ' ORDER BY offset', (pack,)).fetchall()
+                for name, offset, length in entries:
+                    data = self._read(pack, offset, length)
+                    moved = self._append([data])
+                    with self.connection as connection:
+                        connection.execute(
+                            'UPDATE files SET pack = ?, offset = ?'
+                            ' WHERE name = ? AND pack = ?',
+                            (moved[0], moved[1], name, pack))
+                    writable = moved[0]
+                self._unmap(pack)
+                os.unlink(self.pack_path(pack))
+                reclaimed += size - live
+        return reclaimed
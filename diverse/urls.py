@@ -0,0 +1,12 @@
+from django.urls import path
+from . import views
+
+# include into project urls, for example (usually near to admin urls):
+#   path('admin/diverse/', include('diverse.urls')),
+app_name = 'diverse'
+urlpatterns = [
+    path('versions/<str:app_label>/<str:model_name>/<str:field_name>/'
+         '<str:pk>/', views.versions, name='versions'),
+    path('versions/<str:app_label>/<str:model_name>/<str:field_name>/'
+         '<str:pk>/<str:version>/', views.version, name='version'),
+]
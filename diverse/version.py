@@ -1,8 +1,77 @@
 import os
+import json
+import inspect
+import hashlib
+from collections import namedtuple
 from diverse.conveyor import TempFileConveyor
 from diverse.files import VersionFile, VersionImageFile
 
 
+def spec_data(value, depth=0):
+    """
+    get json serializable and stable representation of version spec value:
+    objects as class path with public attrs (recursively, limited depth),
+    attrs declared in "spec_defaults" class attr ({name: default value},
+    options added to existing spec classes) are skipped while they hold
+    default value, so adding of option does not change fingerprints
+    """
+
+    if depth > 8:
+        return None
+    if value is None or isinstance(value, (str, int, float, bool,)):
+        return value
+    if isinstance(value, (list, tuple, set, frozenset,)):
+        value = [spec_data(i, depth + 1) for i in value]
+        return sorted(value, key=repr) if isinstance(value, set) else value
+    if isinstance(value, dict):
+        return [[str(i), spec_data(value[i], depth + 1)]
+                for i in sorted(value, key=str)]
+    if isinstance(value, type) or inspect.isroutine(value):
+        return '%s.%s' % (getattr(value, '__module__', ''),
+                          getattr(value, '__qualname__', ''),)
+
+    cls = value.__class__
+    attrs = getattr(value, '__dict__', None)
+    if attrs is None:
+        attrs = dict((i, getattr(value, i, None),)
+                     for i in getattr(cls, '__slots__', ()))
+    defaults = getattr(cls, 'spec_defaults', None) or {}
+    return ['%s.%s' % (cls.__module__, cls.__qualname__,),
+            [[i, spec_data(attrs[i], depth + 1)]
+             for i in sorted(attrs) if not i.startswith('_') and not (
+                 i in defaults and attrs[i] == defaults[i])]]
+
+
+class VersionPlan(namedtuple('VersionPlan', (
+        'version', 'versionfile', 'attrname', 'processors', 'conveyor',
+        'storage', 'accessor', 'filename', 'extension', 'fingerprint',
+        'layout',))):
+    """
+    Immutable precompiled version spec (see BaseVersion.compile), binding
+    of source file to plan is the only work on each version access.
+    filename  - pattern with named keys or None (versionfile default)
+    extension - static value, ":same" (taken from source file name) or None
+                (suggested by versionfile itself)
+    """
+
+    __slots__ = ()
+
+    def bind(self, source_file, data=None, parent=None):
+        extension = self.extension
+        if extension == ':same':
+            extension = (parent.extension() if parent else
+                         os.path.splitext(source_file.name)[1].lower() or None)
+        filename = (self.filename % self.version.filenamedict(source_file)
+                    if self.filename else None)
+        return self.versionfile(self.attrname, source_file, self.processors,
+                                filename=filename, extension=extension,
+                                storage=self.storage, data=data,
+                                conveyor=self.conveyor,
+                                accessor=self.accessor,
+                                fingerprint=self.fingerprint,
+                                parent=parent, layout=self.layout)
+
+
 class BaseVersion(object):
     # default values
     attrname = None
@@ -12,18 +81,22 @@ class BaseVersion(object):
     extension = None
     storage = None
     accessor = None
+    layout = None
+    source = None
+    _fingerprint = None
+    _source_version = None
 
     def __init__(self, processors,
                  attrname=None, conveyor=None, versionfile=None,
                  filename=None, extension=None, storage=None,
-                 accessor=None):
+                 accessor=None, source=None, layout=None):
         """
         processors  - list or one of processor instances
         attrname    - name of version file (usually assign by container)
         conveyor    - processors conveyor class
         versionfile - real file class (some like django FieldFile)
         filename    - pattern with named keys (dirname, basename, attrname,
-                      extension) or callable (important: result must be source
+                      fingerprint, extension) or callable (important: result must be source
                       content independent):
                         receive source_file, namedict and additional args
                         return pattern with one %s key for extension
@@ -32,14 +105,20 @@ class BaseVersion(object):
                       by processors)
         storage     - django file storage instance (todo: :default -> default storage)
         accessor    - access policy configuration params
+        source      - name of version to generate this one from (instead of
+                      original source file), it should be less in size, but
+                      big enough for this version processing (sizes chain)
+        layout      - versions directory layout (see diverse.layout), it is
+                      used if filename is not defined
         """
 
+        self.source = source or self.source
         self.processors = (processors if isinstance(processors, list) else
                            [processors])
         self.params(attrname=attrname, conveyor=conveyor,
                     versionfile=versionfile, filename=filename,
                     extension=extension, storage=storage,
-                    accessor=accessor, force=True)
+                    accessor=accessor, layout=layout, force=True)
 
         if not self.versionfile:
             raise ValueError('Versionfile value is required (by init args'
@@ -47,15 +126,17 @@ class BaseVersion(object):
 
     def params(self,
                attrname=None, conveyor=None, versionfile=None, filename=None,
-               extension=None, storage=None, accessor=None, force=False):
+               extension=None, storage=None, accessor=None, layout=None,
+               force=False):
         """
         each param purpose look at __init__ docstring
         this method alters each param only if original value is None or force
         """
 
-        pdict = ('attrname', 'conveyor', 'versionfile',
-                 'filename', 'extension', 'storage', 'accessor',)
-        pdict = dict([(i, locals().get(i, None)) for i in pdict])
+        pdict = {'attrname': attrname, 'conveyor': conveyor,
+                 'versionfile': versionfile, 'filename': filename,
+                 'extension': extension, 'storage': storage,
+                 'accessor': accessor, 'layout': layout,}
         check = lambda name: ((force and pdict.get(name) is not None) or
                               getattr(self, name) is None)
 
@@ -70,13 +151,33 @@ class BaseVersion(object):
                           self.extension)
         self.storage = storage if check('storage') else self.storage
         self.accessor = accessor if check('accessor') else self.accessor
+        self.layout = layout if check('layout') else self.layout
+        self._fingerprint = None
+
+    def fingerprint(self):
+        """
+        stable short hash of version spec (processors with its options,
+        versionfile, conveyor, extension and source version fingerprint),
+        changes of it mean that generated version files are stale
+        """
+
+        if self._fingerprint is None:
+            data = spec_data([self.processors, self.versionfile,
+                              self.conveyor, self.extension,])
+            # derived version depends on source version spec
+            if self._source_version:
+                data.append(self._source_version.fingerprint())
+            data = json.dumps(data, separators=(',', ':',), default=repr)
+            self._fingerprint = hashlib.md5(
+                data.encode('utf-8')).hexdigest()[:12]
+        return self._fingerprint
 
     def getextension(self, source_file, *args):
         return self.extension
 
     # fast no regexp is extension checking
     def _check_extension(self, value):
-        return (value and isinstance(value, basestring) and
+        return (value and isinstance(value, str) and
                 len(value) > 1 and value.startswith('.'))
 
     def getfilename(self, source_file, *args):
@@ -92,7 +193,8 @@ class BaseVersion(object):
         dirname, basename = os.path.split(source_file.name)
         basename, extension = os.path.splitext(basename)
         return {'dirname': dirname, 'basename': basename,
-                'attrname': self.attrname, 'extension': r'%s',}
+                'attrname': self.attrname, 'extension': r'%s',
+                'fingerprint': self.fingerprint(),}
 
     def arguments(self, source_file, data=None):
         if not self.attrname:
@@ -103,6 +205,8 @@ class BaseVersion(object):
         kwarguments = {'conveyor': self.conveyor,
                        'storage': self.storage,
                        'accessor': self.accessor,
+                       'fingerprint': self.fingerprint(),
+                       'layout': self.layout,
                        'data': data,}
 
         # add data related values
@@ -114,10 +218,61 @@ class BaseVersion(object):
 
         return self.versionfile, arguments, kwarguments
 
-    def version(self, source_file, instantiate=True, data=None):
+    def version(self, source_file, instantiate=True, data=None, parent=None):
         cls, args, kwargs = self.arguments(source_file, data=data)
+        parent and kwargs.update(parent=parent)
         return cls(*args, **kwargs) if instantiate else (cls, args, kwargs)
 
+    def link_source(self, version):
+        """link source version instance (called by container)"""
+        self._source_version, self._fingerprint = version, None
+
+    # precompilation
+    _dynamic_methods = ('getfilename', 'filenamedict', 'getextension',
+                        'arguments', 'version',)
+
+    def compile(self):
+        """
+        get VersionPlan or None if version spec depends on source file in
+        any way except filename pattern (callable filename or overridden
+        getters), in that case version method should be used on each access
+        """
+
+        if not self.attrname:
+            raise ValueError('Attrname value is required (by init args,'
+                             ' class property or direct assignation).')
+        if callable(self.filename) or any(
+                getattr(type(self), i) is not getattr(BaseVersion, i)
+                for i in self._dynamic_methods):
+            return None
+
+        return VersionPlan(
+            version=self, versionfile=self.versionfile,
+            attrname=self.attrname, processors=tuple(self.processors),
+            conveyor=self.conveyor, storage=self.storage,
+            accessor=self.accessor, filename=self.filename,
+            extension=self.extension or self._static_extension(),
+            fingerprint=self.fingerprint(), layout=self.layout,
+        )
+
+    def _static_extension(self):
+        """
+        get extension by processors without file version (like versionfile
+        _suggested_extension), None if it is unknown or depends on it
+        """
+
+        extension = None
+        for proc in self.processors[::-1]:
+            try:
+                extension = proc.extension(None) or ''
+            except Exception:
+                return None
+            if not extension == ':same':
+                break
+        return (extension
+                if extension == ':same' or self._check_extension(extension)
+                else None)
+
 
 # build in version classes
 class Version(BaseVersion):
@@ -0,0 +1,209 @@
+import re
+import hashlib
+import mimetypes
+from django.apps import apps
+from django.http import (JsonResponse, HttpResponse, HttpResponseRedirect,
+                         HttpResponseNotModified, Http404)
+from django.utils.http import http_date
+from django.core.exceptions import PermissionDenied, SuspiciousFileOperation
+from django.contrib.admin.views.decorators import staff_member_required
+from django.urls import reverse, NoReverseMatch
+from .conveyor import HASH_LENGTH
+
+
+def versions_url(file, version=None):
+    """
+    get deterministic url of versions info endpoint for field file (or of
+    redirect endpoint to the version file if version name is specified),
+    return None if diverse urls are not included or instance is not saved
+    """
+
+    instance = getattr(file, 'instance', None)
+    if not instance or instance.pk is None:
+        return None
+
+    kwargs = {'app_label': instance._meta.app_label,
+              'model_name': instance._meta.model_name,
+              'field_name': file.field.name, 'pk': instance.pk,}
+    if version:
+        kwargs['version'] = version
+    try:
+        return reverse('diverse:version' if version else 'diverse:versions',
+                       kwargs=kwargs)
+    except NoReverseMatch:
+        return None
+
+
+def get_field_file(request, app_label, model_name, field_name, pk):
+    # import here to avoid circular import (fields -> widgets -> views)
+    from .fields.fields import DiverseFileField
+
+    try:
+        model = apps.get_model(app_label, model_name)
+        field = model._meta.get_field(field_name)
+    except (LookupError, ValueError):
+        raise Http404('Model or field does not exist.')
+    if not isinstance(field, DiverseFileField):
+        raise Http404('Field is not a diverse file field.')
+
+    opts = model._meta
+    if not any(request.user.has_perm('%s.%s_%s' % (opts.app_label, perm,
+                                                   opts.model_name))
+               for perm in ('view', 'change',)):
+        raise PermissionDenied
+
+    instance = model._default_manager.filter(pk=pk).first()
+    file = instance and getattr(instance, field.attname)
+    if not file:
+        raise Http404('Object or file does not exist.')
+    return file
+
+
+def version_data(versionfile):
+    data = {'name': versionfile.name,
+            'url': versionfile.url,
+            'mimetype': versionfile.mimetype,
+            'etag': getattr(versionfile, 'etag', None),}
+    data.update((i, getattr(versionfile, i),)
+                for i in versionfile.attrs_rel)
+    return data
+
+
+@staff_member_required
+def versions(request, app_label, model_name, field_name, pk):
+    """
+    json info of each (or requested by "version" GET param) version,
+    version files are generated here (if required), not in admin form render
+    """
+
+    file = get_field_file(request, app_label, model_name, field_name, pk)
+    container = file.dc
+
+    names = request.GET.getlist('version') or list(container._versions.keys())
+    if any(i not in container._versions for i in names):
+        raise Http404('Version does not exist.')
+
+    return JsonResponse({
+        'name': file.name, 'url': file.url,
+        'versions': dict((i, version_data(getattr(container, i)),)
+                         for i in names),
+    })
+
+
+@staff_member_required
+def version(request, app_label, model_name, field_name, pk, version):
+    """redirect to version file url (generate it if required)"""
+
+    file = get_field_file(request, app_label, model_name, field_name, pk)
+    container = file.dc
+
+    if version not in container._versions:
+        raise Http404('Version does not exist.')
+    url = getattr(container, version).url
+    if not url:
+        raise Http404('Version file is not available.')
+    return HttpResponseRedirect(url)
+
+
+# version files serving
+IMMUTABLE_MAX_AGE = 31536000
+
+
+def content_headers(response, content_hash, versioned=False, max_age=None):
+    """
+    set caching headers of version file content: etag by content hash (see
+    accessor content_hash) and cache control, url with the same content
+    hash (versioned, see accessor versioned url) is cached as immutable
+    """
+
+    response['ETag'] = '"%s"' % content_hash
+    if versioned:
+        response['Cache-Control'] = ('public, max-age=%s, immutable'
+                                     % IMMUTABLE_MAX_AGE)
+    elif max_age is not None:
+        response['Cache-Control'] = 'public, max-age=%s' % max_age
+    else:
+        response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def serve(request, name, storage, max_age=None):
+    """
+    serve version file of storage with etag (content hash, the same as in
+    versioned url) revalidation, url with actual "v" param is cached as
+    immutable, usage in urlpatterns (instead of static serving):
+        path('media/<path:name>', serve, {'storage': default_storage})
+    """
+
+    try:
+        with storage.open(name, 'rb') as fp:
+            data = fp.read()
+    except (FileNotFoundError, IsADirectoryError, SuspiciousFileOperation):
+        raise Http404('File does not exist.')
+
+    content_hash = hashlib.md5(data).hexdigest()[:HASH_LENGTH]
+    versioned = request.GET.get('v', None) == content_hash
+    if '"%s"' % content_hash in request.headers.get('If-None-Match', ''):
+        return content_headers(HttpResponseNotModified(), content_hash,
+                               versioned, max_age)
+    response = HttpResponse(data, content_type=(
+        mimetypes.guess_type(name)[0] or 'application/octet-stream'))
+    return content_headers(response, content_hash, versioned, max_age)
+
+
+# pack storage files serving
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def pack(request, name, storage, max_age=None):
+    """
+    serve file of diverse.storages.PackStorage (single range requests and
+    etag revalidation are supported), usage in urlpatterns:
+        path('media/packs/<path:name>', pack, {'storage': thumbs_storage})
+    """
+
+    entry = storage.entry(name)
+    if entry is None:
+        raise Http404('File does not exist.')
+    pack, offset, size, mtime = entry
+
+    etag = '"%x-%x-%x"' % (pack, offset, size,)
+    if etag in request.headers.get('If-None-Match', ''):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    start, length, status = 0, size, 200
+    match = RANGE_RE.match(request.headers.get('Range', '').strip())
+    if match and any(match.groups()):
+        first, last = match.groups()
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            # suffix range: last n bytes
+            start = max(0, size - int(last))
+            end = size - 1
+        if start >= size or end < start:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%s' % size
+            return response
+        length, status = end - start + 1, 206
+
+    try:
+        data = storage.read(entry, start, length)
+    except FileNotFoundError:
+        # pack is compacted after index lookup
+        raise Http404('File does not exist.')
+
+    response = HttpResponse(data, status=status, content_type=(
+        mimetypes.guess_type(name)[0] or 'application/octet-stream'))
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(mtime)
+    response['Accept-Ranges'] = 'bytes'
+    if status == 206:
+        response['Content-Range'] = 'bytes %s-%s/%s' % (
+            start, start + length - 1, size)
+    if max_age is not None:
+        response['Cache-Control'] = 'public, max-age=%s' % max_age
+    return response
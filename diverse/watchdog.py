@@ -0,0 +1,109 @@
+"""
+Time limited calls of processors (see TempFileConveyor time limits).
+
+Function is called in forked child process, its result (or exception) is
+sent back by pipe, child is killed if time limit is exceeded, so caller
+(web worker) waits not longer than limit. Where fork is not available (or
+while profiling, which measures current process only) limit is soft:
+function is called inline and its elapsed time is checked after call, it
+is not a bound of call duration (call is not interrupted).
+
+Forked child has only calling thread of multithreaded worker: locks held
+by other threads at fork time stay locked in child, so supervised function
+should not use shared state of process (caches, write-behind buffer,
+logging handlers of other threads); database connections inherited from
+parent are detached in child (not closed, that would terminate sessions
+of parent), child opens its own connection if it is required.
+"""
+import time
+import multiprocessing
+from django.db import connections
+from . import profiling
+
+
+# connections of parent detached in child (kept to be never finalized)
+_detached = []
+
+
+class TimeLimitExceeded(Exception):
+    def __init__(self, limit, elapsed, cancelled=True):
+        self.limit, self.elapsed, self.cancelled = limit, elapsed, cancelled
+        super(TimeLimitExceeded, self).__init__(
+            'Time limit exceeded: %.3fs of %.3fs (%s).'
+            % (elapsed, limit, 'cancelled' if cancelled else 'soft limit'))
+
+
+def fork_context():
+    """get fork multiprocessing context or None if it is not available"""
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return None
+    return multiprocessing.get_context('fork')
+
+
+def detach_connections():
+    """forget database connections of parent in forked child"""
+    for connection in connections.all():
+        if connection.connection is not None:
+            _detached.append(connection.connection)
+            connection.connection = None
+
+
+def _child(sender, func, args, kwargs):
+    try:
+        detach_connections()
+        result = ('ok', func(*args, **kwargs),)
+    except BaseException as e:
+        result = ('error', e,)
+    try:
+        sender.send(result)
+    except Exception:
+        # unpicklable result or exception
+        sender.send(('error', RuntimeError(
+            'Supervised call error: %r' % (result[1],)),))
+    finally:
+        sender.close()
+
+
+def call(func, args=(), kwargs=None, limit=None):
+    """
+    call function with time limit (seconds, None - inline call without
+    any limits), raise TimeLimitExceeded if it is exceeded
+    """
+
+    kwargs = kwargs or {}
+    if not limit:
+        return func(*args, **kwargs)
+
+    context = fork_context()
+    if context is None or profiling.active():
+        start = time.monotonic()
+        result = func(*args, **kwargs)
+        elapsed = time.monotonic() - start
+        if elapsed > limit:
+            raise TimeLimitExceeded(limit, elapsed, cancelled=False)
+        return result
+
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=_child,
+                              args=(sender, func, args, kwargs,))
+    start = time.monotonic()
+    process.start()
+    sender.close()
+    try:
+        if not receiver.poll(limit):
+            raise TimeLimitExceeded(limit, time.monotonic() - start)
+        try:
+            status, value = receiver.recv()
+        except EOFError:
+            process.join()
+            raise RuntimeError('Supervised process exited unexpectedly'
+                               ' (exit code %s).' % process.exitcode)
+    finally:
+        # kill is available since python 3.7
+        process.is_alive() and getattr(process, 'kill', process.terminate)()
+        process.join()
+        receiver.close()
+
+    if status == 'error':
+        raise value
+    return value
@@ -0,0 +1,16 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from . import settings
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(name='default', workers=None):
+    """get shared bounded thread pool executor by name (create if required)"""
+    with _executors_lock:
+        if name not in _executors:
+            _executors[name] = ThreadPoolExecutor(
+                max_workers=workers or settings.WORKERS,
+                thread_name_prefix='diverse-%s' % name)
+        return _executors[name]
@@ -0,0 +1,175 @@
+"""
+Write-behind buffer of model cache updates.
+
+Cache writes (usually made by versions generation on read requests) are
+collected in process memory and written later by middleware at request
+end (diverse.middleware.WriteBehindMiddleware, rows touched by request
+thread only) or by background flusher (all rows): updates of one row by
+any threads are coalesced into one statement and writes of values, which
+are written already, are skipped. Buffered values are lost on process
+crash, that is safe: missing cache values are recomputed.
+"""
+import json
+import time
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+from django.db import DatabaseError, close_old_connections
+from . import settings
+
+
+logger = logging.getLogger('diverse.writebehind')
+
+
+class WriteBehindBuffer(object):
+    # count of rows with remembered written values (to skip identical writes)
+    written_size = 10000
+    # count of pending rows of thread, which are written at once (by thread
+    # itself) if it is exceeded (thread without flushing middleware)
+    pending_size = 1000
+
+    def __init__(self, interval=None):
+        self.interval = (settings.WRITE_BEHIND_INTERVAL
+                         if interval is None else interval)
+        # pending rows (shared by threads) and rowkeys touched by threads
+        self.pending = OrderedDict()
+        self.owners = {}
+        self.written = OrderedDict()
+        self.lock = threading.Lock()
+        self.flusher = None
+
+    def __len__(self):
+        return len(self.pending)
+
+    def rowkey(self, cache, instance, cachefield):
+        """
+        key of row state: file name is a part of it, so values of previous
+        file are not written after file change (row is filtered by it too)
+        """
+
+        fieldname = cachefield[:-len('_cache')]
+        file = getattr(instance, fieldname, None)
+        return (cache.__class__, instance.__class__,
+                instance._state.db or 'default', instance.pk, cachefield,
+                fieldname, getattr(file, 'name', file),)
+
+    def add(self, cache, instance, cachefield, changed=None, deleted=None):
+        rowkey = self.rowkey(cache, instance, cachefield)
+        with self.lock:
+            owned = self.owners.setdefault(threading.get_ident(), set())
+            entry = self.pending.setdefault(rowkey, ({}, set(),))
+            written = self.written.get(rowkey, {})
+            for key, data in (changed or {}).items():
+                digest = json.dumps(data, sort_keys=True, default=repr)
+                if written.get(key) == digest:
+                    # identical value is written already
+                    entry[0].pop(key, None)
+                    continue
+                entry[0][key] = data
+                entry[1].discard(key)
+            for key in deleted or []:
+                entry[0].pop(key, None)
+                entry[1].add(key)
+                written.pop(key, None)
+            if not entry[0] and not entry[1]:
+                self.pending.pop(rowkey)
+            else:
+                owned.add(rowkey)
+            overflow = len(owned) > self.pending_size
+        if overflow:
+            self.flush(current=True)
+        self.start()
+
+    def forget(self, cache, instance, cachefield, keys=None):
+        """
+        forget written values of row (all or of keys), it is called on each
+        cache write, which is not buffered (full value write, deletion in
+        memory only), so values written after it are not skipped
+        """
+
+        rowkey = self.rowkey(cache, instance, cachefield)
+        with self.lock:
+            if keys is None:
+                self.written.pop(rowkey, None)
+            else:
+                for key in keys:
+                    self.written.get(rowkey, {}).pop(key, None)
+
+    def flush(self, current=False):
+        """
+        write pending rows (touched by current thread only if current,
+        otherwise all), return count of updated ones
+        """
+
+        with self.lock:
+            if current:
+                rowkeys = self.owners.pop(threading.get_ident(), ())
+            else:
+                rowkeys, self.owners = list(self.pending.keys()), {}
+            pending = [(i, self.pending.pop(i),) for i in rowkeys
+                       if i in self.pending]
+
+        count = 0
+        for rowkey, (changed, deleted) in pending:
+            # database of write is chosen by router (not loaded from one)
+            cache, model, db, pk, cachefield, fieldname, name = rowkey
+            try:
+                updated = cache().update_row(
+                    model, pk, cachefield, changed=changed, deleted=deleted,
+                    filters={fieldname: name})
+            except DatabaseError:
+                # cache values only, they will be recomputed
+                continue
+            except Exception:
+                logger.exception('Write-behind update error.')
+                continue
+            # row is deleted or its file is changed: values are outdated
+            if updated:
+                count += 1
+                self.remember(rowkey, changed)
+        return count
+
+    def remember(self, rowkey, changed):
+        with self.lock:
+            written = self.written.setdefault(rowkey, {})
+            for key, data in changed.items():
+                written[key] = json.dumps(data, sort_keys=True, default=repr)
+            self.written.move_to_end(rowkey)
+            while len(self.written) > self.written_size:
+                self.written.popitem(last=False)
+
+    # background flusher
+    def start(self):
+        if not self.interval or self.flusher is not None:
+            return
+        with self.lock:
+            if self.flusher is None:
+                self.flusher = threading.Thread(
+                    target=self.run, name='diverse-writebehind', daemon=True)
+                self.flusher.start()
+
+    def run(self):
+        try:
+            while True:
+                time.sleep(self.interval)
+                try:
+                    self.flush()
+                except Exception:
+                    # rows are dropped (cache values are recomputed)
+                    logger.exception('Write-behind flush error.')
+                finally:
+                    close_old_connections()
+        finally:
+            # flusher is started again by next add
+            self.flusher = None
+
+
+buffer = WriteBehindBuffer()
+
+
+def flush():
+    return buffer.flush()
+
+
+atexit.register(flush)
@@ -61,6 +61,7 @@ setup(
         'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
 
         'Operating System :: OS Independent',
 
@@ -87,6 +88,7 @@ setup(
     # Extras (optional features with their own dependencies)
     extras_require={
         'pilkit': ['pilkit',],
+        'numpy': ['numpy', 'Pillow',],
     },
 
     python_requires='>=3.6,<4',
@@ -0,0 +1,58 @@
+"""
+Version spec fingerprints are stored with generated versions, any change
+of them for unchanged spec makes all versions stale (regenerated).
+Run as (from repository root):
+    PYTHONPATH=. python -m unittest discover tests
+"""
+import unittest
+import django
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure()
+    django.setup()
+
+from diverse.processor import BaseProcessor
+from diverse.version import Version, spec_data
+
+
+class Processor(BaseProcessor):
+    # fingerprint contains class path, it should not depend on test loader
+    __module__ = 'reference'
+
+    def __init__(self, width, height, options=None):
+        self.width, self.height = width, height
+        self.options = options or {}
+
+    def extension(self, filever):
+        return '.jpg'
+
+
+class OptionProcessor(Processor):
+    # option added after fingerprints of Processor specs are stored
+    spec_defaults = {'strip': False,}
+
+    def __init__(self, width, height, options=None, strip=False):
+        super(OptionProcessor, self).__init__(width, height, options)
+        self.strip = strip
+
+
+class FingerprintTestCase(unittest.TestCase):
+    def test_reference_spec(self):
+        version = Version([Processor(100, 100, {'quality': 90,}),])
+        self.assertEqual(version.fingerprint(), 'e6725c7c0aec')
+
+    def test_default_option_is_skipped(self):
+        data = spec_data(OptionProcessor(100, 100))
+        self.assertEqual(data[1], spec_data(Processor(100, 100))[1])
+        self.assertNotEqual(
+            spec_data(OptionProcessor(100, 100, strip=True))[1], data[1])
+
+    def test_spec_changes(self):
+        one = Version([Processor(100, 100),]).fingerprint()
+        self.assertEqual(one, Version([Processor(100, 100),]).fingerprint())
+        self.assertNotEqual(one, Version([Processor(100, 90),]).fingerprint())
+
+
+if __name__ == '__main__':
+    unittest.main()
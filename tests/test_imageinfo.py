@@ -0,0 +1,51 @@
+"""
+Header-only image info detection.
+Run as (from repository root):
+    PYTHONPATH=. python -m unittest discover tests
+"""
+import io
+import unittest
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from diverse.imageinfo import get_image_info, sniff
+
+
+def encode(img, format, **options):
+    data = io.BytesIO()
+    img.save(data, format, **options)
+    data.seek(0)
+    return data
+
+
+@unittest.skipIf(Image is None, 'Pillow is not installed')
+class ImageInfoTestCase(unittest.TestCase):
+    def test_bmp(self):
+        data = encode(Image.new('RGB', (30, 20,)), 'BMP')
+        info = get_image_info(data)
+        self.assertEqual((info.format, info.width, info.height,),
+                         ('BMP', 30, 20,))
+        # two bytes magic only is not enough
+        for header in (b'BMW is a car brand.' * 4, b'BM',
+                       b'BM' + b'\x00' * 12 + b'\x10\x00\x00\x00' * 2):
+            self.assertEqual(sniff(header), (None, None,))
+
+    def test_frames(self):
+        frames = [Image.new('RGB', (10, 10,), (i * 50, 0, 0,))
+                  for i in range(5)]
+        for format in ('GIF', 'WEBP',):
+            data = encode(frames[0], format, save_all=True,
+                          append_images=frames[1:], duration=100)
+            # default: animated or not (counted up to 2)
+            self.assertEqual(get_image_info(data).frames, 2, format)
+            self.assertEqual(get_image_info(data, max_frames=0).frames, 1)
+            self.assertEqual(get_image_info(data, max_frames=None).frames,
+                             5)
+            self.assertEqual(get_image_info(data, max_frames=2).frames, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
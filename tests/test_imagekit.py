@@ -0,0 +1,39 @@
+"""
+ImageKit processor specs (pilkit is required, tests are skipped without).
+Run as (from repository root):
+    PYTHONPATH=. python -m unittest discover tests
+"""
+import unittest
+import django
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure()
+    django.setup()
+
+try:
+    from diverse.processors.imagekit import ImageKit, ikp
+except ImportError:
+    ImageKit = None
+
+from diverse.version import ImageVersion
+
+
+@unittest.skipIf(ImageKit is None, 'pilkit is not installed')
+class ImageKitFingerprintTestCase(unittest.TestCase):
+    def version(self, **kwargs):
+        return ImageVersion(ImageKit(processors=[ikp.ResizeToFit(100, 100)],
+                                     format='JPEG', options={'quality': 90},
+                                     **kwargs))
+
+    def test_reference_spec(self):
+        # value of the same spec before bytes budget options are added
+        self.assertEqual(self.version().fingerprint(), 'b9f7e14265c1')
+
+    def test_budget_options(self):
+        self.assertNotEqual(self.version(max_bytes=10000).fingerprint(),
+                            self.version().fingerprint())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+"""
+Numpy processors batches (numpy and pilkit are required, tests are skipped
+without). Run as (from repository root):
+    PYTHONPATH=. python -m unittest discover tests
+"""
+import io
+import unittest
+from contextlib import contextmanager
+import django
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure()
+    django.setup()
+
+try:
+    from PIL import Image
+    from diverse.processors.imagekit import ImageKit, ikp
+    from diverse.processors.numpy import (ColorAdjust, AutoLevels, Sharpen,
+                                          DominantColor, process_batch)
+except ImportError:
+    ImageKit = None
+
+
+def image(size, mode='RGB', seed=0):
+    img = Image.linear_gradient('L').resize(size).rotate(seed * 40)
+    return Image.merge('RGB', (img, img.transpose(Image.FLIP_LEFT_RIGHT),
+                               img.transpose(Image.FLIP_TOP_BOTTOM),)
+                       ).convert(mode)
+
+
+class FileVersion(object):
+    def __init__(self, img):
+        data = io.BytesIO()
+        img.save(data, 'PNG')
+        self.data, self.generation_meta = data.getvalue(), {}
+        self.source_file = None
+
+    @contextmanager
+    def process_source(self):
+        yield io.BytesIO(self.data)
+
+
+@unittest.skipIf(ImageKit is None, 'numpy or pilkit is not installed')
+class ProcessBatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.shapes = []
+        shapes = self.shapes
+
+        class Adjust(ColorAdjust):
+            def process_batch(self, batch):
+                shapes.append(batch.shape)
+                return super(Adjust, self).process_batch(batch)
+
+        self.processors = [Adjust(contrast=1.2, saturation=0.8),
+                           DominantColor(), AutoLevels(), Sharpen()]
+
+    def test_process_batch(self):
+        images = [image((40, 30,), seed=1), image((40, 30,), 'RGBA', 2),
+                  image((40, 30,), seed=3), image((20, 20,), 'L', 4)]
+        features = [{} for i in images]
+        result = process_batch(self.processors, images, features)
+        # same-size images of same mode are processed at once
+        self.assertEqual(sorted(self.shapes), [(1, 20, 20, 1),
+                                               (1, 30, 40, 4),
+                                               (2, 30, 40, 3)])
+        for img, processed, values in zip(images, result, features):
+            for processor in self.processors:
+                img = (processor.process(img) if not hasattr(
+                           processor, 'analyze_batch') else
+                       processor.process(img, FileVersion(img)))
+            self.assertEqual(processed.mode, img.mode)
+            self.assertEqual(processed.tobytes(), img.tobytes())
+            self.assertEqual(list(values), ['dominant_color'])
+
+    def test_prepare_batch(self):
+        processor = ImageKit(processors=[ikp.ResizeToFill(32, 32)] +
+                             self.processors + [ikp.ResizeToFit(16, 16)],
+                             format='PNG')
+        images = [image((64, 48,), seed=i) for i in range(3)]
+        filevers = [FileVersion(i) for i in images]
+        processor.prepare_batch(filevers)
+        self.assertEqual(self.shapes, [(3, 32, 32, 4)])
+
+        for img, filever in zip(images, filevers):
+            prepared = processor._process_content(
+                'a.png', io.BytesIO(filever.data), filever)
+            expected = FileVersion(img)
+            content = processor._process_content(
+                'a.png', io.BytesIO(expected.data), expected)
+            self.assertEqual(prepared.read(), content.read())
+            self.assertEqual(filever.generation_meta,
+                             expected.generation_meta)
+            self.assertIn('dominant_color',
+                          filever.generation_meta['features'])
+
+
+if __name__ == '__main__':
+    unittest.main()
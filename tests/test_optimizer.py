@@ -0,0 +1,91 @@
+"""
+ImageKit pipeline optimizer (pilkit is required, tests are skipped without).
+Run as (from repository root):
+    PYTHONPATH=. python -m unittest discover tests
+"""
+import os
+import unittest
+
+try:
+    from PIL import Image
+    from diverse.processors.imagekit import ikp
+    from diverse.processors.imagekit.optimizer import (optimize, verify,
+                                                       FusedResize)
+except ImportError:
+    ikp = None
+
+SAMPLE = os.path.join(os.path.dirname(__file__), os.pardir, 'diverse',
+                      'tests', 'samples', 'sample.jpg')
+
+
+@unittest.skipIf(ikp is None, 'pilkit is not installed')
+class OptimizerTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        with Image.open(SAMPLE) as img:
+            cls.img = img.convert('RGB').resize((2400, 1800,))
+
+    def names(self, processors, reorder=False):
+        return [type(i).__name__
+                for i in optimize(processors, self.img.size, reorder)]
+
+    def assertVerified(self, processors, reorder=False):
+        result, value = verify(processors, self.img, reorder=reorder)
+        self.assertTrue(result, 'difference is %s' % value)
+
+    def test_geometry(self):
+        chains = [
+            [ikp.ResizeToFill(300, 200)],
+            [ikp.ResizeToFit(800, 800), ikp.ResizeToFill(200, 200)],
+            [ikp.ResizeToFit(500, 500), ikp.Crop(300, 300)],
+            [ikp.ResizeToCover(400, 400), ikp.Crop(400, 400)],
+        ]
+        for processors in chains:
+            self.assertEqual(self.names(processors), ['FusedResize'])
+            self.assertVerified(processors)
+
+    def test_upscale_after_downscale(self):
+        # details are lost by downscaling: it is not fused with upscaling
+        processors = [ikp.ResizeToFit(200, 200), ikp.ResizeToFit(400, 400)]
+        self.assertEqual(self.names(processors), ['FusedResize'] * 2)
+        self.assertVerified(processors)
+
+    def test_order_is_kept(self):
+        processors = [ikp.ResizeToFit(2000, 2000),
+                      ikp.Adjust(brightness=1.3),
+                      ikp.ResizeToFit(600, 600), ikp.Crop(400, 400)]
+        self.assertEqual(self.names(processors),
+                         ['FusedResize', 'Adjust', 'FusedResize'])
+        self.assertVerified(processors)
+
+    def test_reorder(self):
+        processors = [ikp.ResizeToFit(2000, 2000),
+                      ikp.Adjust(brightness=0.8, color=0.5),
+                      ikp.ResizeToFit(600, 600), ikp.Crop(400, 400)]
+        self.assertEqual(self.names(processors, reorder=True),
+                         ['FusedResize', 'Adjust'])
+        self.assertVerified(processors, reorder=True)
+        fused = optimize(processors, self.img.size, reorder=True)[0]
+        self.assertIsInstance(fused, FusedResize)
+        self.assertEqual(fused.size, (400, 400,))
+
+    def test_reorder_clamped(self):
+        # factors greater than 1 are clamped: adjustments are not moved
+        for adjust in (ikp.Adjust(brightness=1.5), ikp.Adjust(contrast=1.8),
+                       ikp.Adjust(sharpness=1.5),):
+            processors = [adjust, ikp.ResizeToFit(300, 300)]
+            self.assertEqual(self.names(processors, reorder=True),
+                             ['Adjust', 'FusedResize'])
+            self.assertVerified(processors, reorder=True)
+
+    def test_reorder_contrast_crop(self):
+        # contrast uses mean of image, it is not moved across cropping
+        processors = [ikp.Adjust(contrast=0.7), ikp.ResizeToFit(600, 600),
+                      ikp.Crop(400, 400)]
+        self.assertEqual(self.names(processors, reorder=True),
+                         ['FusedResize', 'Adjust', 'FusedResize'])
+        self.assertVerified(processors, reorder=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
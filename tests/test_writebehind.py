@@ -0,0 +1,96 @@
+"""
+Write-behind buffer of model cache updates.
+Run as (from repository root):
+    PYTHONPATH=. python -m unittest discover tests
+"""
+import threading
+import unittest
+
+import django
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure()
+    django.setup()
+
+from diverse.writebehind import WriteBehindBuffer
+
+
+class State(object):
+    db = 'default'
+
+
+class Instance(object):
+    _state = State()
+
+    def __init__(self, pk, name='sample.jpg'):
+        self.pk = pk
+        self.image = name
+
+
+class Cache(object):
+    updates = []
+
+    def update_row(self, model, pk, cachefield, changed=None, deleted=None,
+                   filters=None):
+        self.updates.append((pk, dict(changed), set(deleted), filters,))
+        return 1
+
+
+class WriteBehindTestCase(unittest.TestCase):
+    def setUp(self):
+        Cache.updates = []
+        self.buffer = WriteBehindBuffer(interval=0)
+
+    def add_in_thread(self, instance, changed):
+        thread = threading.Thread(target=self.buffer.add, args=(
+            Cache(), instance, 'image_cache', changed,))
+        thread.start()
+        thread.join()
+
+    def test_coalesce(self):
+        # identical writes of concurrent threads make one update
+        for i in range(2):
+            self.add_in_thread(Instance(1), {'thumb': {'w': 10}})
+        self.add_in_thread(Instance(1), {'small': {'w': 5}})
+        self.assertEqual(len(self.buffer), 1)
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(Cache.updates, [
+            (1, {'thumb': {'w': 10}, 'small': {'w': 5}}, set(),
+             {'image': 'sample.jpg'},),
+        ])
+
+    def test_dedupe(self):
+        self.buffer.add(Cache(), Instance(1), 'image_cache', {'thumb': 1})
+        self.buffer.flush()
+        # written value is skipped, changed one is not
+        self.buffer.add(Cache(), Instance(1), 'image_cache', {'thumb': 1})
+        self.assertEqual(len(self.buffer), 0)
+        self.buffer.add(Cache(), Instance(1), 'image_cache', {'thumb': 2})
+        self.assertEqual(self.buffer.flush(), 1)
+        # new file of row is not deduplicated by values of previous one
+        self.buffer.add(Cache(), Instance(1, 'other.jpg'), 'image_cache',
+                        {'thumb': 2})
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual([i[1] for i in Cache.updates],
+                         [{'thumb': 1}, {'thumb': 2}, {'thumb': 2}])
+
+    def test_flush_current(self):
+        # request flushes rows touched by its thread only
+        self.add_in_thread(Instance(1), {'thumb': 1})
+        self.buffer.add(Cache(), Instance(2), 'image_cache', {'thumb': 1})
+        self.assertEqual(self.buffer.flush(current=True), 1)
+        self.assertEqual([i[0] for i in Cache.updates], [2])
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual([i[0] for i in Cache.updates], [2, 1])
+
+    def test_pending_size(self):
+        self.buffer.pending_size = 2
+        for i in range(3):
+            self.buffer.add(Cache(), Instance(i), 'image_cache', {'thumb': 1})
+        self.assertEqual(len(self.buffer), 0)
+        self.assertEqual(len(Cache.updates), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()